@@ -0,0 +1,169 @@
+# produces batches of slices of ASPECT .pvtu output from a slice spec, e.g.,
+#
+#   python aspect_batch_slices.py aspect_slices.json
+#
+# The spec is a JSON (or, with PyYAML installed, YAML) file:
+#
+# {
+#   "data_dir": "fault_formation",            # relative to $ASPECTdatadir
+#   "datasets": ["solution-00050.pvtu"],      # file names or glob patterns in data_dir
+#   "output_dir": "../figures/slices",
+#   "workers": 4,
+#   "defaults": {"field": "strain_rate", "cmap": "magma", "log": true, "hide_axes": true},
+#   "slices": [
+#     {"name": "fault_xsec", "axis": "x", "fraction": 0.5},
+#     {"axis": "z", "fractions": [0.2, 0.5, 0.8], "fields": ["strain_rate", "T"]},
+#     {"axis": "y", "position": 2.0e5, "cmap": "viridis"}
+#   ]
+# }
+#
+# Each slice entry takes an axis and positions either as coordinates ("position" or
+# "positions", in the mesh units) or as fractions of the domain extent ("fraction" or
+# "fractions"), plus a "field" or a list of "fields". Anything else (cmap, log,
+# hide_axes, width, name) falls back to "defaults". Every entry is expanded over its
+# fields and positions and over all datasets. Images are named
+# {dataset}_{name}_{field}.png, where name defaults to {axis}{position}.
+#
+# Every dataset is read from the .vtu files once, into the binary cache of pvuFile
+# (see pvuFile.build_cache). The worker processes memory-map that cache, so the
+# arrays are shared through the page cache instead of re-read per worker, and each
+# worker only copies out the pieces that cross the plane it is slicing.
+
+import argparse
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import yt
+from pvuLoder import pvuFile
+
+_slice_settings = ('cmap', 'log', 'hide_axes', 'width', 'name')
+
+
+def read_spec(spec_file):
+    """ reads a slice spec from a .json, .yaml or .yml file """
+    with open(spec_file) as sfi:
+        if os.path.splitext(spec_file)[1] in ('.yaml', '.yml'):
+            import yaml
+            return yaml.safe_load(sfi)
+        return json.load(sfi)
+
+
+def dataset_files(spec):
+    """ the .pvtu files of a spec, in order """
+    data_dir = os.path.join(os.environ.get('ASPECTdatadir', './'), spec.get('data_dir', ''))
+    files = []
+    for pattern in spec['datasets']:
+        matches = sorted(glob.glob(os.path.join(data_dir, pattern)))
+        if len(matches) == 0:
+            print(f"data file not found: {os.path.join(data_dir, pattern)}")
+        files.extend(matches)
+    return files
+
+
+def expand_slices(spec, domain_left, domain_right):
+    """ expands the slice entries of a spec into one dict per plane of a dataset,
+    each with the axis, the position in mesh units and the list of images (field and
+    settings) to make on that plane """
+    defaults = spec.get('defaults', {})
+    planes = {}
+    for entry in spec['slices']:
+        settings = dict(defaults, **entry)
+        axis = 'xyz'.index(settings['axis'])
+        if 'fields' in entry:
+            fields = entry['fields']
+        elif 'field' in entry:
+            fields = [entry['field']]
+        else:
+            fields = defaults.get('fields', [defaults.get('field')])
+
+        if 'position' in entry or 'positions' in entry:
+            positions = entry.get('positions', [entry.get('position')])
+        else:
+            fractions = entry.get('fractions', [entry.get('fraction', 0.5)])
+            positions = [domain_left[axis] + frac * (domain_right[axis] - domain_left[axis]) for frac in fractions]
+
+        for position in positions:
+            plane = planes.setdefault((axis, float(position)), {'axis': axis, 'position': float(position), 'images': []})
+            for field in fields:
+                image = {key: settings[key] for key in _slice_settings if key in settings}
+                image['field'] = field
+                plane_name = f"{'xyz'[axis]}{position:.6g}"
+                if 'name' not in image:
+                    image['name'] = plane_name
+                elif len(positions) > 1:
+                    image['name'] = image['name'] + '_' + plane_name
+                plane['images'].append(image)
+    return list(planes.values())
+
+
+def run_batch(spec):
+    """ produces all the slices of a spec, returns the list of files written """
+    output_dir = spec.get('output_dir', './')
+    os.makedirs(output_dir, exist_ok=True)
+    workers = spec.get('workers', os.cpu_count())
+
+    tasks = []
+    for pFile in dataset_files(spec):
+        # read the .vtu files once, into the cache that the workers memory-map
+        pvuData = pvuFile(pFile)
+        if pvuData.cache_is_valid() is False:
+            pvuData.build_cache(workers=workers)
+        piece_bounds = pvuData.piece_index()
+        domain_left = piece_bounds[:, 0, :].min(axis=0)
+        domain_right = piece_bounds[:, 1, :].max(axis=0)
+        for plane in expand_slices(spec, domain_left, domain_right):
+            tasks.append((pFile, plane, domain_left, domain_right, output_dir))
+    print(f"rendering {sum(len(task[1]['images']) for task in tasks)} slices on {len(tasks)} planes")
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_slice_plane, *zip(*tasks)))
+    else:
+        results = [_slice_plane(*task) for task in tasks]
+    return [fname for fnames in results for fname in fnames]
+
+
+def _slice_plane(pFile, plane, domain_left, domain_right, output_dir):
+    # loads the pieces crossing a plane from the cache and saves each of its images
+    axis = plane['axis']
+    fields = sorted({image['field'] for image in plane['images']})
+    pvuData = pvuFile(pFile)
+    pvuData.load(fields=fields, use_cache=True, plane=(axis, plane['position']))
+    ds = yt.load_unstructured_mesh(
+        pvuData.connectivity,
+        pvuData.coordinates,
+        node_data = pvuData.get_node_data(fields),
+        length_unit="m"
+    )
+    pvuData.release()
+
+    center = (domain_left + domain_right) / 2.
+    center[axis] = plane['position']
+    stem = os.path.splitext(os.path.basename(pFile))[0]
+    fnames = []
+    for image in plane['images']:
+        fld = ('all', image['field'])
+        slc = yt.SlicePlot(ds, 'xyz'[axis], fld, center=center, width=image.get('width'))
+        slc.set_log(fld, image.get('log', True))
+        if 'cmap' in image:
+            slc.set_cmap(fld, image['cmap'])
+        if image.get('hide_axes', False):
+            slc.hide_axes()
+        fname = os.path.join(output_dir, f"{stem}_{image['name']}_{image['field']}.png")
+        slc.save(fname)
+        fnames.append(fname)
+    return fnames
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="batch slices of ASPECT .pvtu output")
+    parser.add_argument('spec', help="the slice spec, a .json or .yaml file")
+    parser.add_argument('--workers', type=int, default=None, help="overrides the workers of the spec")
+    args = parser.parse_args()
+
+    spec = read_spec(args.spec)
+    if args.workers is not None:
+        spec['workers'] = args.workers
+    fnames = run_batch(spec)
+    print(f"saved {len(fnames)} slices to {spec.get('output_dir', './')}")
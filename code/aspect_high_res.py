@@ -9,29 +9,37 @@ pFile=os.path.join(DataDir,'solution-00050.pvtu')
 if os.path.isfile(pFile) is False:
     print(f"data file not found: {pFile}")
 
-# instantiate our manual pvu loader and load into memory (takes a while!)
+# instantiate our manual pvu loader. The per-piece bounding box index (built once and
+# saved next to the data) gives the domain extent, and each slice below only loads the
+# pieces that intersect it. 
 pvuData=pvuFile(pFile)
-pvuData.load()
+piece_bounds=pvuData.piece_index()
+domain_left=piece_bounds[:,0,:].min(axis=0)
+domain_right=piece_bounds[:,1,:].max(axis=0)
+c_val=(domain_left+domain_right)/2.
 
-# create the yt dataset
-ds = yt.load_unstructured_mesh(
-    pvuData.connectivity,
-    pvuData.coordinates,
-    node_data = pvuData.node_data,
-    length_unit="m"
-)
+def load_slice_ds(plane):
+    # load only the strain rate of the pieces crossing the plane, create the yt dataset
+    pvuData.load(fields=["strain_rate"],plane=plane)
+    return yt.load_unstructured_mesh(
+        pvuData.connectivity,
+        pvuData.coordinates,
+        node_data = pvuData.node_data,
+        length_unit="m"
+    )
 
 # create a couple slices in strain rate: 
 sr_cmap = 'magma'
 
-slc = yt.SlicePlot(ds,'x',('all','strain_rate'))
+ds = load_slice_ds(('x',c_val[0]))
+slc = yt.SlicePlot(ds,'x',('all','strain_rate'),center=c_val)
 slc.set_log('strain_rate',True)
 slc.set_cmap(('all','strain_rate'),sr_cmap)
 slc.hide_axes()
 slc.save('../figures/aspect_fault_xsec.png')
 
-c_val = ds.domain_center
-c_arr = np.array([c_val[0],c_val[1],ds.domain_width[2]*0.8])
+c_arr = np.array([c_val[0],c_val[1],(domain_right[2]-domain_left[2])*0.8])
+ds = load_slice_ds(('z',c_arr[2]))
 slc = yt.SlicePlot(ds,'z',('all','strain_rate'),center=c_arr)
 slc.set_log('strain_rate',True)
 slc.set_cmap(('all','strain_rate'),sr_cmap)
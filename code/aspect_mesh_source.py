@@ -1,45 +1,40 @@
 from mesh_animator import mesh_animator as MA 
+from pvuLoder import pvuFile
+from yt.visualization.volume_rendering.api import MeshSource
 import numpy as np 
 import yt 
 import os
 
-ds = yt.load('aspect/fault_formation/solution-00050.pvtu')
-sc = yt.create_scene(ds,('connect1','strain_rate')) # this is the slowest step 
-
-ms = sc.get_source()
-ms.cmap = 'magma'
-ms.color_bounds = (1e-20,1e-14)
-
-# now let's construct the flight path 
-reload(MA)
+# construct the flight path first, so that only the part of the mesh seen along the 
+# path has to be loaded 
 FP0 = MA.flight_path(frame_offset = 5)
 
 # first anchor must have all fields
 FP0.add_anchor(1,
-              cam_position=ds.arr([200.0, 200.0, 200.0], 'km'),
-              cam_width=ds.arr([600, 600, 600], 'km'),
-              north_vector=ds.arr([0.0, 1.0, 0.0], 'dimensionless'),
-              focus=ds.arr([250.0, 250.0, 50.0], 'km'),
+              cam_position=yt.YTArray([200.0, 200.0, 200.0], 'km'),
+              cam_width=yt.YTArray([600, 600, 600], 'km'),
+              north_vector=yt.YTArray([0.0, 1.0, 0.0], 'dimensionless'),
+              focus=yt.YTArray([250.0, 250.0, 50.0], 'km'),
               )
                             
 # rotate north_vector
 FP0.add_anchor(5,
-              north_vector=ds.arr([0.0, 0., 0.1], 'dimensionless')
+              north_vector=yt.YTArray([0.0, 0., 0.1], 'dimensionless')
               )
 
 # narrow the camera field of view (zooms in)
 FP0.add_anchor(5,
-              cam_width=ds.arr([300, 300, 300], 'km'),
+              cam_width=yt.YTArray([300, 300, 300], 'km'),
               )
 
 # move camera position closer to center
 FP0.add_anchor(5,
-              cam_position=ds.arr([200.0, 200.0, 100.0], 'km')
+              cam_position=yt.YTArray([200.0, 200.0, 100.0], 'km')
               )
 
 # and move a bit closer
 pos = FP0.flight_path[-1]['cam_position']*0.9
-FP1.add_anchor(5, cam_position=pos)
+FP0.add_anchor(5, cam_position=pos)
               
 # narrow the field of view a bit more
 wid = FP0.flight_path[-1]['cam_width']*0.8
@@ -47,15 +42,15 @@ FP0.add_anchor(5, cam_width=wid)
 
 # move position to side-view
 FP0.add_anchor(5,
-              cam_position=ds.arr([100.0, 200.0, 100.0], 'km')
+              cam_position=yt.YTArray([100.0, 200.0, 100.0], 'km')
               )
 
 # move position to side-view
-FP0.add_anchor(5, cam_position=ds.arr([200.0, 100.0, 100.0], 'km'))
+FP0.add_anchor(5, cam_position=yt.YTArray([200.0, 100.0, 100.0], 'km'))
 
 # zoom and move closer 
-pos = FP1.flight_path[-1]['cam_position']
-wid = FP1.flight_path[-1]['cam_width']*.7
+pos = FP0.flight_path[-1]['cam_position']
+wid = FP0.flight_path[-1]['cam_width']*.7
 pos[1] = pos[1]*0.7; pos[2] = pos[2]*0.7
 FP0.add_anchor(10, cam_position=pos, cam_width=wid)
 
@@ -69,6 +64,24 @@ FP0.add_anchor(20, **final_pos)
 # and sit here a bit too
 FP0.add_anchor(10)
 
+# load only the .vtu pieces visible in at least one frame of the flight path and 
+# build the scene from them, one mesh source per piece (this is the slowest step)
+pvuData = pvuFile('aspect/fault_formation/solution-00050.pvtu')
+pvuData.load(fields=['strain_rate'], flight_path=FP0)
+ds = yt.load_unstructured_mesh(
+    pvuData.connectivity,
+    pvuData.coordinates,
+    node_data = pvuData.node_data,
+    length_unit="m"
+)
+sc = yt.create_scene(ds,('connect1','strain_rate')) 
+for mesh_id in range(2, len(pvuData.connectivity) + 1):
+    sc.add_source(MeshSource(ds, (f'connect{mesh_id}','strain_rate')))
+
+for ms in sc.sources.values(): # the scene only holds mesh sources
+    ms.cmap = 'magma'
+    ms.color_bounds = (1e-20,1e-14)
+
 # now render it all 
 save_dir = '../figures/aspect_3d'
 if os.path.isdir(save_dir) is False:
@@ -0,0 +1,411 @@
+# benchmarks the loaders and renderers on synthetic inputs, e.g.,
+#
+#   python benchmark.py --size small --save-baseline baseline.json
+#   python benchmark.py --size small --compare baseline.json
+#
+# Synthetic multi-piece ASPECT-like .pvtu/.vtu meshes and CM1-like and seismic-like
+# netCDF volumes are generated in --data-dir (default ./.benchmark_data) on the first
+# run at each size and re-used afterwards. Each benchmark reports the best wall time
+# of --repeats runs, the throughput and the peak memory allocated in this process
+# during one extra run traced with tracemalloc. tracemalloc does not see worker
+# processes, so the benchmarks with workers also report the summed peak resident set
+# of their workers, sampled from /proc (linux only). With --compare, benchmarks that
+# got slower or use more memory than the baseline by more than --tolerance are
+# reported as regressions and the script exits with status 1. flight_animator_workers
+# also checks that the frames rendered across worker processes are identical to the
+# serial render.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from functools import partial
+import numpy as np
+import meshio
+import netCDF4 as nc4
+import yt
+from yt.visualization.volume_rendering.api import MeshSource
+from pvuLoder import pvuFile
+from mesh_animator import mesh_animator as MA
+import cm1_helper as CH
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../notebooks/resources")))
+
+# elements per piece edge, number of pieces, netCDF volume shape, flight path anchors
+# and frames between anchors, rendered frames and their resolution
+sizes = {
+    'small': {'piece_cells': 8, 'n_pieces': 8, 'volume': (64, 64, 32), 'anchors': 20,
+              'steps': 10, 'render_frames': 4, 'resolution': (64, 64)},
+    'medium': {'piece_cells': 16, 'n_pieces': 16, 'volume': (192, 192, 64), 'anchors': 50,
+               'steps': 20, 'render_frames': 8, 'resolution': (128, 128)},
+    'large': {'piece_cells': 24, 'n_pieces': 32, 'volume': (400, 400, 100), 'anchors': 100,
+              'steps': 50, 'render_frames': 8, 'resolution': (256, 256)},
+}
+
+
+def make_pvtu(out_dir, n_pieces, piece_cells):
+    """ writes a .pvtu file and n_pieces hexahedral .vtu pieces of piece_cells**3
+    elements each, with the velocity, T and strain_rate fields, returns the .pvtu file """
+    os.makedirs(out_dir, exist_ok=True)
+    n = piece_cells
+    # pieces are laid out along x, in km like the fault_formation model
+    dx = 1000.
+    ijk = np.stack(np.meshgrid(*[np.arange(n + 1)] * 3, indexing='ij'), axis=-1).reshape(-1, 3)
+    vert_id = np.arange((n + 1) ** 3).reshape(n + 1, n + 1, n + 1)
+    corners = [(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0), (0, 0, 1), (1, 0, 1), (1, 1, 1), (0, 1, 1)]
+    cells = np.stack([vert_id[i:i + n, j:j + n, k:k + n].ravel() for i, j, k in corners], axis=1)
+    rng = np.random.default_rng(0)
+    pieces = []
+    for piece_id in range(n_pieces):
+        pts = (ijk + [piece_id * n, 0, 0]) * dx
+        point_data = {
+            'velocity': rng.normal(size=pts.shape),
+            'T': 273. + pts[:, 2] / 1e3,
+            'strain_rate': 10 ** (-20 + 6 * np.exp(-((pts[:, 1] - pts[:, 0] / 2.) / (4 * n * dx)) ** 2)),
+        }
+        fname = f"solution-00001.{piece_id:04d}.vtu"
+        meshio.write(os.path.join(out_dir, fname), meshio.Mesh(pts, [("hexahedron", cells)], point_data=point_data))
+        pieces.append(fname)
+
+    xml = ('<?xml version="1.0"?>\n<VTKFile type="PUnstructuredGrid" version="0.1">\n'
+           '<PUnstructuredGrid GhostLevel="0">\n<PPointData Scalars="scalars">\n'
+           '<PDataArray type="Float64" Name="velocity" NumberOfComponents="3" format="binary"/>\n'
+           '<PDataArray type="Float64" Name="T" format="binary"/>\n'
+           '<PDataArray type="Float64" Name="strain_rate" format="binary"/>\n'
+           '</PPointData>\n<PPoints>\n<PDataArray type="Float64" NumberOfComponents="3" format="binary"/>\n'
+           '</PPoints>\n')
+    xml += ''.join(f'<Piece Source="{fname}"/>\n' for fname in pieces)
+    xml += '</PUnstructuredGrid>\n</VTKFile>\n'
+    pFile = os.path.join(out_dir, 'solution-00001.pvtu')
+    with open(pFile, 'w') as pfi:
+        pfi.write(xml)
+    return pFile
+
+
+def make_cm1_netcdf(fname, shape):
+    """ writes a CM1 LOFS-like netCDF file with a dbz field on an (x, y, z) shape grid """
+    nx, ny, nz = shape
+    with nc4.Dataset(fname, 'w') as handle:
+        handle.cm1_lofs_version = 1
+        handle.uniform_mesh = 1
+        for dim, size in [('time', 1), ('zh', nz), ('yh', ny), ('xh', nx)]:
+            handle.createDimension(dim, size)
+        for dim, size, lo, hi in [('xh', nx, -20., 20.), ('yh', ny, -20., 20.), ('zh', nz, 0.1, 15.)]:
+            coord = handle.createVariable(dim, 'f4', (dim,))
+            coord[:] = np.linspace(lo, hi, size)
+            coord.units = 'km'
+        time_var = handle.createVariable('time', 'f8', ('time',))
+        time_var[:] = [4400.]
+        time_var.units = 's'
+        dbz = handle.createVariable('dbz', 'f4', ('time', 'zh', 'yh', 'xh'))
+        dbz.units = 'dBZ'
+        x, y = np.meshgrid(handle['xh'][:], handle['yh'][:], indexing='xy')
+        for k, z in enumerate(handle['zh'][:]):
+            dbz[0, k] = 70 * np.exp(-((x - 3) ** 2 / 40 + (y + 2) ** 2 / 30 + (z - 5) ** 2 / 10))
+
+
+def make_seismic_netcdf(fname, shape):
+    """ writes an IRIS EMC-like netCDF file with a dvs field on a (depth, latitude,
+    longitude) grid, with NaNs outside of a masked region like the interpolated grids """
+    n_lon, n_lat, n_depth = shape
+    with nc4.Dataset(fname, 'w') as handle:
+        for dim, size, lo, hi in [('depth', n_depth, 0., 1200.), ('latitude', n_lat, 30., 50.),
+                                  ('longitude', n_lon, -125., -100.)]:
+            handle.createDimension(dim, size)
+            coord = handle.createVariable(dim, 'f4', (dim,))
+            coord[:] = np.linspace(lo, hi, size)
+        dvs = handle.createVariable('dvs', 'f4', ('depth', 'latitude', 'longitude'))
+        dvs.units = 'percent'
+        rng = np.random.default_rng(0)
+        for k in range(n_depth):
+            layer = rng.normal(scale=1.5, size=(n_lat, n_lon))
+            layer[:, :n_lon // 10] = np.nan
+            dvs[k] = layer
+
+
+def generate(data_dir, size):
+    """ generates (or re-uses) the synthetic inputs for a size, returns their paths """
+    params = sizes[size]
+    size_dir = os.path.join(data_dir, size)
+    inputs = {'pvtu': os.path.join(size_dir, 'aspect', 'solution-00001.pvtu'),
+              'cm1': os.path.join(size_dir, 'cm1.nc'),
+              'seismic': os.path.join(size_dir, 'seismic.nc')}
+    params_file = os.path.join(size_dir, 'params.json')
+    if os.path.isfile(params_file):
+        with open(params_file) as pfi:
+            if json.load(pfi) == json.loads(json.dumps(params)):
+                return inputs
+
+    print(f"generating {size} synthetic inputs in {size_dir}")
+    os.makedirs(size_dir, exist_ok=True)
+    make_pvtu(os.path.dirname(inputs['pvtu']), params['n_pieces'], params['piece_cells'])
+    make_cm1_netcdf(inputs['cm1'], params['volume'])
+    make_seismic_netcdf(inputs['seismic'], params['volume'])
+    with open(params_file, 'w') as pfi:
+        json.dump(params, pfi)
+    return inputs
+
+
+def measure(func, repeats=3):
+    """ returns the best wall time of repeats calls of func, the peak memory (bytes)
+    allocated in this process during one more call traced with tracemalloc and the
+    summed peak resident set (bytes) of the worker processes during that call """
+    times = []
+    for _ in range(repeats):
+        t_start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t_start)
+    tracemalloc.start()
+    with worker_memory() as workers:
+        func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak, workers.peak
+
+
+class worker_memory(object):
+    """ context manager sampling the peak resident set (VmHWM) of every child process
+    of this process in a background thread. self.peak is the sum over the children,
+    None where /proc is not available. The resident set includes pages shared with
+    this process after the fork, so it is an upper bound of the extra memory. """
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = None
+        self._peaks = {}
+        self._done = threading.Event()
+
+    def __enter__(self):
+        if os.path.isdir('/proc/self/task'):
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if os.path.isdir('/proc/self/task'):
+            self._done.set()
+            self._thread.join()
+            self.peak = sum(self._peaks.values())
+        return False
+
+    def _sample(self):
+        while True:
+            for pid in _child_pids():
+                try:
+                    with open(f'/proc/{pid}/status') as sfi:
+                        hwm = [line for line in sfi if line.startswith('VmHWM:')]
+                except OSError:
+                    continue  # exited since it was listed
+                if len(hwm):
+                    self._peaks[pid] = max(self._peaks.get(pid, 0), int(hwm[0].split()[1]) * 1024)
+            if self._done.wait(self.interval):
+                return
+
+
+def _child_pids():
+    # pids of the running child processes of this process, from /proc/<pid>/stat
+    pids = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as sfi:
+                    stat = sfi.read()
+            except OSError:
+                continue
+            if int(stat.rsplit(')', 1)[1].split()[1]) == os.getpid():
+                pids.append(int(entry))
+    return pids
+
+
+def _pvu_load(pFile, **load_kwargs):
+    pvuData = pvuFile(pFile, cache_dir=os.path.join(os.path.dirname(pFile), '.pvu_cache', 'bench'))
+    pvuData.load(**load_kwargs)
+    return pvuData
+
+
+def _build_flight_path(n_anchors, steps):
+    fp = MA.flight_path()
+    fp.add_anchor(1,
+                  cam_position=yt.YTArray([200.0, 200.0, 200.0], 'km'),
+                  cam_width=yt.YTArray([600, 600, 600], 'km'),
+                  north_vector=yt.YTArray([0.0, 1.0, 0.0], 'dimensionless'),
+                  focus=yt.YTArray([250.0, 250.0, 50.0], 'km'))
+    rng = np.random.default_rng(0)
+    for _ in range(n_anchors - 1):
+        fp.add_anchor(steps,
+                      cam_position=yt.YTArray(rng.uniform(100., 300., 3), 'km'),
+                      cam_width=yt.YTArray(rng.uniform(200., 600.) * np.ones(3), 'km'))
+    return fp.flight_path
+
+
+def _mesh_scene(pFile, resolution):
+    pvuData = _pvu_load(pFile, fields=['strain_rate'])
+    ds = yt.load_unstructured_mesh(pvuData.connectivity, pvuData.coordinates,
+                                   node_data=pvuData.node_data, length_unit="m")
+    sc = yt.create_scene(ds, ('connect1', 'strain_rate'))
+    for mesh_id in range(2, len(pvuData.connectivity) + 1):
+        sc.add_source(MeshSource(ds, (f'connect{mesh_id}', 'strain_rate')))
+    for ms in sc.sources.values():
+        ms.cmap = 'magma'
+        ms.color_bounds = (1e-20, 1e-14)
+    sc.camera.set_resolution(resolution)
+    return sc, ds
+
+
+def _mesh_scene_factory(pFile, resolution):
+    return _mesh_scene(pFile, resolution)[0]
+
+
+def run_benchmarks(inputs, size, repeats=3, only=None):
+    """ runs the benchmarks, returns a dict of results keyed by benchmark name """
+    params = sizes[size]
+    n_elements = params['n_pieces'] * params['piece_cells'] ** 3
+    n_voxels = int(np.prod(params['volume']))
+    pFile = inputs['pvtu']
+    results = {}
+
+    def bench(name, func, work, units):
+        if only is not None and name not in only:
+            return
+        wall, peak, worker_peak = measure(func, repeats)
+        results[name] = {'time': wall, 'throughput': work / wall, 'units': units, 'peak_memory': peak}
+        if worker_peak:
+            results[name]['worker_peak_memory'] = worker_peak
+        print(f"{name}: {wall:.4f} s")
+
+    bench('pvu_load', lambda: _pvu_load(pFile), n_elements, 'elements')
+    bench('pvu_load_workers', lambda: _pvu_load(pFile, workers=4), n_elements, 'elements')
+    bench('pvu_load_fields', lambda: _pvu_load(pFile, fields=['strain_rate']), n_elements, 'elements')
+    _pvu_load(pFile, use_cache=True)  # builds the cache outside of the timing
+    bench('pvu_load_cache', lambda: _pvu_load(pFile, use_cache=True).get_node_data(['strain_rate']),
+          n_elements, 'elements')
+
+    pvuData = pvuFile(pFile)
+    pieces = [meshio.read(srcFi) for srcFi in pvuData._source_files()]
+    def parse_all():
+        for mesh_id, mesh in enumerate(pieces):
+            pvuData.parseNodeData(mesh.point_data, mesh.cells[0].data, f"connect{mesh_id + 1}")
+    bench('parseNodeData', parse_all, n_elements, 'elements')
+
+    n_frames = (params['anchors'] - 1) * params['steps'] + 1
+    bench('flight_path', lambda: _build_flight_path(params['anchors'], params['steps']), n_frames, 'frames')
+
+    if only is None or {'flight_animator', 'flight_animator_workers'} & set(only):
+        sc, ds = _mesh_scene(pFile, params['resolution'])
+        frames = _build_flight_path(2, params['render_frames'] - 1)
+        span = float(np.asarray(pvuData.piece_index()).max()) * 1.5
+        for pt in frames:  # look at the whole synthetic mesh
+            pt['cam_position'] = yt.YTArray([span, span, span], 'm')
+            pt['focus'] = yt.YTArray([span / 3., 0., 0.], 'm')
+            pt['cam_width'] = yt.YTArray([span, span, span], 'm')
+        with tempfile.TemporaryDirectory() as save_dir:
+            animator = MA.flight_animator(sc, frames, save_dir=save_dir, resolution=params['resolution'])
+            bench('flight_animator', animator.render, len(frames), 'frames')
+            parallel = MA.flight_animator(sc, frames, save_dir=os.path.join(save_dir, 'workers'),
+                                          resolution=params['resolution'])
+            os.makedirs(parallel.save_dir)
+            factory = partial(_mesh_scene_factory, pFile, params['resolution'])
+            bench('flight_animator_workers', lambda: parallel.render(workers=2, scene_factory=factory),
+                  len(frames), 'frames')
+            if 'flight_animator_workers' in results:
+                # the frames rendered across processes must match the serial render
+                if 'flight_animator' not in results:
+                    animator.render()
+                mismatched = [pt['frame'] for pt in frames if not np.array_equal(
+                    MA._read_png(animator.frame_file(pt)), MA._read_png(parallel.frame_file(pt)))]
+                if len(mismatched):
+                    raise RuntimeError(f"frames {mismatched} rendered with workers differ from the serial render")
+
+    bench('cm1_subvolume', lambda: CH.load_subvolume(inputs['cm1'], 'dbz'), n_voxels, 'voxels')
+    n_voxels_stride2 = int(np.prod([(n + 1) // 2 for n in params['volume']]))
+    bench('cm1_subvolume_stride2', lambda: CH.load_subvolume(inputs['cm1'], 'dbz', stride=2),
+          n_voxels_stride2, 'voxels')
+
+    try:
+        import seismic_helper as SH
+    except ImportError as err:
+        print(f"skipping seismic_histogram: {err}")
+    else:
+        def seismic_hist():
+            with nc4.Dataset(inputs['seismic']) as handle:
+                dvs = np.ma.filled(handle.variables['dvs'][:], np.nan)
+            return SH.histCache(dvs).rebin(100, density=True)
+        bench('seismic_histogram', seismic_hist, n_voxels, 'voxels')
+    return results
+
+
+def report(results):
+    """ prints a table of the results, peak memory is allocated in this process and
+    worker memory the summed peak resident set of the worker processes """
+    print(f"{'benchmark':24s} {'time':>11s} {'throughput':>22s} {'peak memory':>12s} {'worker memory':>14s}")
+    for name, result in results.items():
+        worker_mem = f"{result['worker_peak_memory'] / 1e6:11.1f} MB" if 'worker_peak_memory' in result else ''
+        print(f"{name:24s} {result['time']:9.4f} s {result['throughput']:12.4g} {result['units'] + '/s':9s} "
+              f"{result['peak_memory'] / 1e6:9.1f} MB {worker_mem}")
+
+
+def compare(results, baseline, tolerance=0.2):
+    """ prints the change of every benchmark relative to a baseline, returns the names
+    of the benchmarks that regressed by more than tolerance in time, peak memory or
+    worker memory """
+    regressions = []
+    print(f"{'benchmark':24s} {'time':>10s} {'peak memory':>12s} {'worker memory':>14s}")
+    for name, result in results.items():
+        if name not in baseline['results']:
+            print(f"{name:24s} {'(new)':>10s}")
+            continue
+        base = baseline['results'][name]
+        time_ratio = result['time'] / base['time']
+        mem_ratio = result['peak_memory'] / max(base['peak_memory'], 1)
+        regressed = time_ratio > 1 + tolerance or mem_ratio > 1 + tolerance
+        worker_ratio = ''
+        if 'worker_peak_memory' in result and 'worker_peak_memory' in base:
+            ratio = result['worker_peak_memory'] / max(base['worker_peak_memory'], 1)
+            regressed = regressed or ratio > 1 + tolerance
+            worker_ratio = f"{ratio:13.2f}x"
+        if regressed:
+            regressions.append(name)
+        print(f"{name:24s} {time_ratio:9.2f}x {mem_ratio:11.2f}x {worker_ratio:>14s} {'REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'yt': yt.__version__,
+            'machine': platform.machine(), 'cpu_count': os.cpu_count()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="benchmarks on synthetic ASPECT, CM1 and seismic inputs")
+    parser.add_argument('--size', default='small', choices=sorted(sizes.keys()))
+    parser.add_argument('--data-dir', default='./.benchmark_data', help="where synthetic inputs are generated")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--only', nargs='+', default=None, help="names of the benchmarks to run")
+    parser.add_argument('--save-baseline', default=None, help="json file to save the results to")
+    parser.add_argument('--compare', default=None, help="baseline json file to compare the results to")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="relative slow-down or memory growth reported as a regression (default 0.2)")
+    args = parser.parse_args()
+
+    yt.set_log_level(40)
+    inputs = generate(args.data_dir, args.size)
+    results = run_benchmarks(inputs, args.size, repeats=args.repeats, only=args.only)
+    report(results)
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as bfi:
+            json.dump({'size': args.size, 'environment': environment(), 'results': results}, bfi, indent=2)
+        print(f"saved baseline to {args.save_baseline}")
+
+    if args.compare is not None:
+        with open(args.compare) as bfi:
+            baseline = json.load(bfi)
+        if baseline['size'] != args.size:
+            raise ValueError(f"baseline is for size {baseline['size']}, not {args.size}")
+        regressions = compare(results, baseline, args.tolerance)
+        if len(regressions):
+            print(f"regressions: {regressions}")
+            sys.exit(1)
@@ -1,47 +1,105 @@
 # reproduces the volume rendering from the cm1_supercell notebook at a higher
 # resolution -- will take a while to run.
 
+import os
+from functools import partial
+import numpy as np
 import yt
-ds = yt.load('cm1_tornado_lofs/budget-test.04400.000000.nc')
+from yt.visualization.volume_rendering.api import create_volume_source
+from mesh_animator.tiled_render import render_tiled
+import cm1_helper as CH
 
-# standard vol rending
-sc = yt.create_scene(ds,'dbz')
+fname = 'cm1_tornado_lofs/budget-test.04400.000000.nc'
+sigma_clip_val = 3
+res_factor = int(os.environ.get('CM1_RES_FACTOR', 5))
+# only load the part of the domain in view of the camera, every CM1_STRIDE-th cell
+# (e.g., CM1_STRIDE=4 CM1_RES_FACTOR=1 for a quick preview). Set CM1_SUBVOLUME=0
+# to render from the full dataset, CM1_CHECK=1 to compare a low resolution render
+# of the subvolume to one of the full dataset before the high resolution render.
+subvolume = os.environ.get('CM1_SUBVOLUME', '1') != '0'
+stride = int(os.environ.get('CM1_STRIDE', 1))
+check = os.environ.get('CM1_CHECK', '0') != '0'
 
-# Get a reference to the VolumeSource associated with this scene
-# It is the first source associated with the scene, so we can refer to it
-# using index 0.
-source = sc[0]
+def build_scene(subvolume=subvolume, stride=stride):
+    # the dataset is only read once the scene renders
+    ds = yt.load(fname)
 
-# first let's specify the bounds
-bounds = (20,60)
-source.tfh.set_bounds(bounds)
+    # standard vol rending
+    sc = yt.create_scene(ds,'dbz')
 
-# and specify the field and whether or not to work in log space:
-source.set_field('dbz')
-source.set_log(False)
-sigma_clip_val = 3
+    # zoom in
+    zoom_factor = 0.25 # < 1 zooms in
+    init_width = sc.camera.width
+    sc.camera.width = (init_width * zoom_factor)
+
+    # set up
+    pos = sc.camera.position
+    sc.camera.set_position(pos, north_vector=[0, 0, -1])
+
+    if subvolume or stride > 1:
+        # swap in a volume source for only the region in view of the camera
+        load_region(sc, ds=ds, stride=stride)
+    else:
+        # Get a reference to the VolumeSource associated with this scene
+        # It is the first source associated with the scene, so we can refer to it
+        # using index 0.
+        set_transfer_function(sc[0])
+
+    # let's up the resolution (will slow things down!)
+    res = sc.camera.get_resolution()
+    new_res = (int(res[0]*res_factor), int(res[1]*res_factor))
+    sc.camera.set_resolution(new_res)
+    return sc
+
+def load_region(sc, ds=None, stride=stride):
+    # replaces the volume source of the scene by one holding only the region of
+    # the dataset in view of the camera
+    if ds is None:
+        ds = yt.load(fname)
+    left_edge, right_edge = CH.camera_region(sc.camera, ds)
+    ds_sub = CH.load_subvolume(fname, 'dbz', left_edge, right_edge, stride=stride)
+    source = create_volume_source(ds_sub, 'dbz')
+    set_transfer_function(source)
+    sc.add_source(source, keyname='source_00')
 
-# now let's instantiate a transfer function with 5 guassian layers:
-tf = yt.ColorTransferFunction(bounds)
-tf.add_layers(5, colormap='arbre')
-source.tfh.tf = tf
-# source.tfh.bounds = bounds
+def set_transfer_function(source):
+    # first let's specify the bounds
+    bounds = (20,60)
+    source.tfh.set_bounds(bounds)
 
-# zoom in
-zoom_factor = 0.25 # < 1 zooms in
-init_width = sc.camera.width
-sc.camera.width = (init_width * zoom_factor)
+    # and specify the field and whether or not to work in log space:
+    source.set_field('dbz')
+    source.set_log(False)
 
-# set up
-pos = sc.camera.position
-sc.camera.set_position(pos, north_vector=[0, 0, -1])
+    # now let's instantiate a transfer function with 5 guassian layers:
+    tf = yt.ColorTransferFunction(bounds)
+    tf.add_layers(5, colormap='arbre')
+    source.tfh.tf = tf
+    # source.tfh.bounds = bounds
 
-# let's up the resolution (will slow things down!)
-res_factor = 5
-res = sc.camera.get_resolution()
-new_res = (int(res[0]*res_factor), int(res[1]*res_factor))
-sc.camera.set_resolution(new_res)
+def check_subvolume(resolution=(128, 128)):
+    # renders the scene from the full dataset and from the subvolume in view of the
+    # camera, returns the max difference between the two images
+    images = []
+    for sub in (False, True):
+        sc = build_scene(subvolume=sub, stride=1)
+        sc.camera.set_resolution(resolution)
+        images.append(np.asarray(sc.render()))
+    return np.abs(images[0] - images[1]).max()
 
-# finally save it (will render in process)
-sc.save('../figures/cm1_vol_render_highres.png',sigma_clip = sigma_clip_val)
+if __name__ == '__main__':
+    if check:
+        print(f"max difference between the subvolume and full renders: {check_subvolume():.3g}")
 
+    # finally save it. The image is rendered in res_factor x res_factor tiles across
+    # the processes. Each process builds the scene without reading any data and
+    # then only loads the region of the dataset in view of the tile it renders, so
+    # its memory is set by the tile rather than the dataset. Rendering from the full
+    # dataset (CM1_SUBVOLUME=0) reads all of it in every process, so fewer are used.
+    if subvolume or stride > 1:
+        render_tiled(partial(build_scene, subvolume=False, stride=1), '../figures/cm1_vol_render_highres.png',
+                     tiles=res_factor, workers=min(os.cpu_count(), res_factor**2), sigma_clip=sigma_clip_val,
+                     tile_setup=partial(load_region, stride=stride))
+    else:
+        render_tiled(build_scene, '../figures/cm1_vol_render_highres.png', tiles=res_factor,
+                     workers=min(os.cpu_count(), 4), sigma_clip=sigma_clip_val)
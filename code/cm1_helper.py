@@ -0,0 +1,106 @@
+import numpy as np
+import netCDF4 as nc4
+import yt
+from yt.frontends.nc4_cm1.fields import CM1FieldInfo
+
+# on-disk units of the cm1 fields, as in yt's cm1 frontend
+_field_units = {fld: units for fld, (units, _, _) in CM1FieldInfo.known_other_fields}
+
+
+def load_subvolume(fname, fields, left_edge=None, right_edge=None, stride=1, chunk_size=16):
+    """
+    loads a hyperslab of the cell-centered fields of a CM1 LOFS netCDF file as a yt
+    uniform grid dataset
+
+    Parameters
+    ----------
+    fname : str
+        the netCDF file
+    fields : str or list of str
+        the fields to load, e.g., 'dbz'
+    left_edge, right_edge : array-like
+        (x, y, z) bounds of the region of interest in the units of the file's
+        coordinates (default None, the domain edges). Cells with centers within the
+        bounds are loaded.
+    stride : int or tuple
+        load every stride-th cell along each axis, or (x, y, z) strides (default 1)
+    chunk_size : int
+        number of (strided) z levels read from the file at a time (default 16)
+
+    Returns
+    -------
+    a yt dataset with the same length unit and field units as yt.load(fname). The
+    cells are placed on the grid of yt.load(fname) (whose domain spans the first to
+    the last cell center of the file), so a subvolume covers the same region as the
+    corresponding cells of the full dataset and a full-domain load with stride 1 has
+    the same geometry as yt.load(fname).
+
+    e.g.,
+
+    ds = load_subvolume('budget-test.04400.000000.nc', 'dbz', left_edge=[-10, -10, 0],
+                        right_edge=[10, 10, 8], stride=2)
+    """
+    if isinstance(fields, str):
+        fields = [fields]
+    if np.isscalar(stride):
+        stride = (stride, stride, stride)
+
+    with nc4.Dataset(fname) as handle:
+        coord_names = ['xh', 'yh', 'zh']
+        length_unit = handle.variables['xh'].units
+        slices = []
+        bbox = np.empty((3, 2))
+        for dim, coord_name in enumerate(coord_names):
+            coord = np.asarray(handle.variables[coord_name][:], dtype='float64')
+            lo = coord.min() if left_edge is None else left_edge[dim]
+            hi = coord.max() if right_edge is None else right_edge[dim]
+            in_range = np.where((coord >= lo) & (coord <= hi))[0]
+            if in_range.size == 0:
+                raise ValueError(f"no {coord_name} cell centers between {lo} and {hi}")
+            slc = slice(in_range[0], in_range[-1] + 1, stride[dim])
+            slices.append(slc)
+            # cell edges on the spacing that yt.load(fname) uses for the full axis,
+            # so that a subvolume lines up with the full domain
+            n_cells = len(range(slc.start, slc.stop, slc.step))
+            dx = (coord.max() - coord.min()) / coord.size
+            bbox[dim] = [coord.min() + slc.start * dx,
+                         coord.min() + (slc.start + n_cells * slc.step) * dx]
+
+        shape = tuple(len(range(slc.start, slc.stop, slc.step)) for slc in slices)
+        data = {}
+        for fld in fields:
+            var = handle.variables[fld]
+            # variables are stored (time, zh, yh, xh), yt wants (x, y, z)
+            vals = np.empty(shape, dtype='float64')
+            z_slc = slices[2]
+            z_indices = np.arange(z_slc.start, z_slc.stop, z_slc.step)
+            for k0 in range(0, shape[2], chunk_size):
+                k1 = min(k0 + chunk_size, shape[2])
+                block = var[0, z_indices[k0]:z_indices[k1 - 1] + 1:z_slc.step, slices[1], slices[0]]
+                vals[:, :, k0:k1] = np.ma.filled(block, np.nan).T
+            data[fld] = (vals, _field_units.get(fld, ''))
+
+    print(f"loaded {shape} cells of {fields} from {fname}")
+    return yt.load_uniform_grid(data, shape, length_unit=length_unit, bbox=bbox, nprocs=1,
+                                periodicity=(False, False, False))
+
+
+def view_box(camera):
+    """ returns the (left_edge, right_edge) of the axis-aligned box around the view of a
+    (plane-parallel) camera, in code_length """
+    unit_vectors = np.array(camera.unit_vectors)
+    width = camera.width.in_units('code_length').d
+    focus = camera.focus.in_units('code_length').d
+    signs = np.array([[i, j, k] for i in (-1, 1) for j in (-1, 1) for k in (-1, 1)])
+    corners = focus + (signs * width / 2.).dot(unit_vectors)
+    return corners.min(axis=0), corners.max(axis=0)
+
+
+def camera_region(camera, ds, pad=2):
+    """ returns the (left_edge, right_edge) of the part of the domain of ds within the
+    view of a (plane-parallel) camera, in code_length, padded by pad cells """
+    view_left, view_right = view_box(camera)
+    dx = (ds.domain_width / ds.domain_dimensions).in_units('code_length').d
+    left_edge = np.maximum(view_left - pad * dx, ds.domain_left_edge.in_units('code_length').d)
+    right_edge = np.minimum(view_right + pad * dx, ds.domain_right_edge.in_units('code_length').d)
+    return left_edge, right_edge
@@ -1,17 +1,36 @@
+import csv
+import json
 import os 
+import queue
+import subprocess
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from yt.visualization.image_writer import write_bitmap
 
 class flight_path(object):
     """ 
     a helper class to set a sequence of camera views to generate a flight path. 
     
+    Anchor points and interpolated frames are stored as arrays: self.frames holds an 
+    (n_frames, 3) array for each camera attribute and self.frame_numbers the frame 
+    numbers. Adding an anchor only appends the frames between it and the previous 
+    anchor. self.flight_path gives the same frames as a list of dicts, with any 
+    units of the first anchor re-attached.
+    
     see ../aspect_mesh_source.py for example usage.
     """
     def __init__(self,auto_build = True, frame_offset = 0):
         self.anchor_points = []
         self.anchor_keys = ('steps_from_previous','cam_position','cam_width','north_vector','focus')
-        self.flight_path = []
-        self.auto_build = auto_build  # rebuild flight path automatically when adding anchor point 
+        self.cam_keys = self.anchor_keys[1:]
+        self.auto_build = auto_build  # extend flight path automatically when adding anchor point 
         self.frame_offset = frame_offset 
+        self._templates = {}  # first anchor value for each camera key, used to re-attach units
+        self._frame_chunks = {key:[] for key in self.cam_keys}  # frame arrays not yet concatenated
+        self._frames = None
+        self._flight_path = None
         
     def _validate_new_anchor(self,new_anchor): 
         # checks for required anchor keys, if any keys are None, will set current anchor 
@@ -54,30 +73,150 @@ class flight_path(object):
         new_point = (steps_from_previous,cam_position,cam_width,north_vector,focus)
         new_anchor = dict(zip(self.anchor_keys,new_point))
         self.anchor_points.append(self._validate_new_anchor(new_anchor))
-        if len(self.anchor_points) > 1 and self.auto_build:
-            self._build_flight_path()
+        if len(self.anchor_points) == 1: 
+            self._templates = {key:new_anchor[key] for key in self.cam_keys}
+        elif self.auto_build:
+            if len(self.anchor_points) == 2:
+                self._build_flight_path()
+            else:
+                self._extend_flight_path(len(self.anchor_points)-2)
+        
+    def _anchor_arrays(self,first_anchor=0):
+        # (n_anchors, 3) array of each camera key from first_anchor on, in the units 
+        # of the first anchor point, and the steps_from_previous of each anchor
+        anchors = self.anchor_points[first_anchor:]
+        arrays = {}
+        for key in self.cam_keys:
+            arrays[key] = np.array([_strip_units(anchor[key],self._templates[key]) for anchor in anchors],dtype='f8')
+        steps = np.array([anchor['steps_from_previous'] for anchor in anchors],dtype='i8')
+        return arrays, steps
+        
+    def _extend_flight_path(self,first_anchor): 
+        # appends the frames between anchor first_anchor and every later anchor, all 
+        # segments are interpolated in one batch. 
+        arrays, steps = self._anchor_arrays(first_anchor)
+        steps = steps[1:]  # steps into each anchor after the first 
+        segment = np.repeat(np.arange(len(steps)),steps)  # segment of each new frame
+        seg_start = np.concatenate([[0],np.cumsum(steps)[:-1]])
+        frac = (np.arange(segment.size) - seg_start[segment] + 1) / steps[segment]
+        for key in self.cam_keys:
+            vals = arrays[key]
+            self._frame_chunks[key].append(vals[segment] + (vals[segment+1] - vals[segment]) * frac[:,None])
+        self._frames = None
+        self._flight_path = None
         
     def _build_flight_path(self): 
-        # builds a flight path from the anchor points
+        # builds the whole flight path from the anchor points
         if len(self.anchor_points) <= 1: 
             raise ValueError("at least 2 anchor_points are required.")
         
-        starting_point = self.anchor_points[0]
-        starting_point['frame'] = 1 + self.frame_offset 
-        self.flight_path = [starting_point,]
-        a_keys = self.anchor_keys
-        for anchor_id, anchor in enumerate(self.anchor_points):
-            if anchor_id == 0: 
-                continue
+        arrays, _ = self._anchor_arrays()
+        self._frame_chunks = {key:[arrays[key][0:1]] for key in self.cam_keys}
+        self._extend_flight_path(0)
+        
+    @property
+    def frames(self):
+        """ dict of (n_frames, 3) arrays of each camera attribute along the flight path """
+        if self._frames is None:
+            self._frames = {}
+            for key in self.cam_keys:
+                chunks = self._frame_chunks[key]
+                self._frames[key] = np.concatenate(chunks) if len(chunks) else np.empty((0,3))
+                self._frame_chunks[key] = [self._frames[key]] if len(chunks) else []
+        return self._frames
+        
+    @property
+    def frame_numbers(self):
+        """ the frame number of each frame along the flight path """ 
+        n_frames = self.frames['cam_position'].shape[0]
+        return np.arange(n_frames) + 1 + self.frame_offset 
+        
+    @property
+    def flight_path(self):
+        """ the flight path as a list of dicts, one per frame, with keys 'frame' and the camera keys """
+        if self._flight_path is None:
+            frames = self.frames
+            # re-attach units once per key to a copy, each frame gets a row of that copy 
+            with_units = {key:_with_units(frames[key].copy(),self._templates.get(key)) for key in self.cam_keys}
+            self._flight_path = []
+            for i_frame,frame in enumerate(self.frame_numbers):
+                pt = {key:with_units[key][i_frame] for key in self.cam_keys}
+                pt['frame'] = int(frame)
+                self._flight_path.append(pt)
+        return self._flight_path
+        
+    def visible_boxes(self, units = None, margin = 0., extent = None):
+        """ axis-aligned bounding boxes of the region visible in each frame
+
+        Parameters
+        ----------
+        units : str
+            length units to return the boxes in (e.g., 'm'). Only used if the anchor 
+            points have units, default None returns the units of the first anchor.
+        margin : float
+            fractional padding added to each box (default 0.)
+        extent : array-like
+            [left_edge, right_edge] of the data, in the same units as the boxes 
+            (default None). The boxes are cut off where the line of sight leaves it.
+
+        Returns
+        -------
+        boxes : ndarray
+            (n_frames, 2, 3) array with the [left_edge, right_edge] of each frame.
+
+        The visible region of a frame is aligned with the camera (as seen through a 
+        plane-parallel lens): width[0] along east and width[1] along north, centered 
+        on the focus. Along the line of sight it starts at the back plane, width[2]/2 
+        in front of the focus, and has no far end: yt's mesh sampler casts the rays 
+        from the back plane until they leave the mesh. Without an extent, the boxes 
+        are unbounded along the line of sight. 
+        """
+        frames = self.frames
+        vals = {}
+        for key in ('cam_position', 'cam_width', 'focus'):
+            vals[key] = frames[key]
+            if units is not None and hasattr(self._templates.get(key), 'units'):
+                vals[key] = _with_units(frames[key], self._templates[key]).to(units).d
+                
+        normal = vals['focus'] - vals['cam_position']
+        normal /= np.linalg.norm(normal, axis=1)[:, None]
+        north = frames['north_vector'] - np.sum(frames['north_vector'] * normal, axis=1)[:, None] * normal
+        north /= np.linalg.norm(north, axis=1)[:, None]
+        east = np.cross(north, normal)
+        
+        half_width = vals['cam_width'] * (0.5 + margin)
+        half_extent = np.abs(east) * half_width[:, 0:1] + np.abs(north) * half_width[:, 1:2]
+        
+        # distance along the line of sight from the focus to the back plane and to 
+        # the far end of the data
+        near = -half_width[:, 2]
+        if extent is None:
+            far = np.full(near.shape, np.inf)
+        else:
+            extent = np.asarray(extent, dtype='f8')
+            signs = np.array([[i, j, k] for i in (0, 1) for j in (0, 1) for k in (0, 1)])
+            corners = extent[signs, [0, 1, 2]]
+            far = np.max((corners[None, :, :] - vals['focus'][:, None, :]) @ normal[:, :, None], axis=1)[:, 0]
+            far = np.maximum(far, near)
+        with np.errstate(invalid = 'ignore'):
+            ends = [np.where(normal == 0., 0., normal * dist[:, None]) for dist in (near, far)]
+        left_edge = vals['focus'] + np.minimum(*ends) - half_extent
+        right_edge = vals['focus'] + np.maximum(*ends) + half_extent
+        return np.stack([left_edge, right_edge], axis=1)
+
+
+def _strip_units(val,template=None):
+    # values as a plain array, converted to the units of template if both have units
+    if hasattr(val,'units') and hasattr(template,'units'):
+        val = val.to(template.units)
+    return np.asarray(val,dtype='f8')
+
 
-            old_a = self.anchor_points[anchor_id-1]
-            dsteps = anchor['steps_from_previous']
-            dvals = dict(zip(a_keys,[(anchor[ky] - old_a[ky])/dsteps for ky in a_keys]))
-            for flight_step in range(dsteps):
-                pt0 = self.flight_path[-1]
-                new_point = dict(zip(a_keys,[pt0[ky] + dvals[ky] for ky in a_keys]))
-                new_point['frame'] = pt0['frame'] + 1 
-                self.flight_path.append(new_point)
+def _with_units(arr,template):
+    # attaches the units (and unit registry) of template to arr, if template has any
+    if hasattr(template,'units'):
+        return type(template)(arr,template.units,registry=template.units.registry)
+    return arr
 
 
 class flight_animator(object):
@@ -102,33 +241,405 @@ class flight_animator(object):
         sigma_clip : None or float
             if not None, gets passed to sc.save('savename.png',sigma_clip = sigma_clip)
             default is None.
+        video_file : None or str
+            if not None, frames are also piped to an ffmpeg subprocess as they are 
+            rendered and encoded into this video file (default None). 
+        save_png : bool
+            if True (default), save each frame as a png in save_dir. Set to False with a 
+            video_file to skip the intermediate pngs entirely.
+        fps : int
+            frames per second of the video_file (default 15)
+        max_queued_frames : int
+            maximum number of rendered frames waiting for the video encoder, rendering 
+            pauses when the encoder falls this far behind (default 4).
             
-    after instantiating, call flight_animator.render() to render all frames. 
+    after instantiating, call flight_animator.render() to render all frames (or first 
+    flight_animator.preview() for a quick low-resolution check of the path). The camera 
+    state of each saved frame is recorded in save_dir/.camera_states/ so that an 
+    interrupted or modified animation can be continued with render(resume=True).
+    
+    The wall time of each rendering stage of every frame is recorded in 
+    self.frame_timings (see write_timing_report).
     '''
-    def __init__(self, yt_scene, flight_path, base_name = 'mesh_source_', save_dir='./', resolution = (400,400), sigma_clip = None):
+    def __init__(self, yt_scene, flight_path, base_name = 'mesh_source_', save_dir='./', resolution = (400,400), sigma_clip = None,
+                 video_file = None, save_png = True, fps = 15, max_queued_frames = 4):
         self.sc = yt_scene
         self.save_dir = save_dir
         self.base_name = base_name
         self.flight_path = flight_path
         self.resolution = resolution
         self.sigma_clip = sigma_clip
+        self.video_file = video_file
+        self.save_png = save_png
+        self.fps = fps
+        self.max_queued_frames = max_queued_frames
+        self._video = None
         self.zfill_digs = 5        
         self.frame_offset = min([pt['frame'] for pt in flight_path])
+        self.frame_timings = []
         
-    def render(self):
-        """ steps through and renders each frame of the flight path """ 
-        cam = self.sc.camera
-        cam.resolution = self.resolution
-        total_frames = len(self.flight_path)
-        for pt in self.flight_path:
+    def _settings(self):
+        # keyword arguments to re-create this animator for a different scene or path
+        return dict(base_name=self.base_name, save_dir=self.save_dir, 
+                    resolution=self.resolution, sigma_clip=self.sigma_clip, save_png=self.save_png)
+        
+    def frame_file(self, pt):
+        """ the full path of the image file for a flight path frame """
+        frame_name = self.base_name + str(pt['frame']).zfill(self.zfill_digs) + '.png'
+        return os.path.join(self.save_dir,frame_name)
+        
+    def _state_file(self, pt):
+        # the file recording the camera state a frame was rendered with
+        state_name = os.path.basename(self.frame_file(pt)) + '.json'
+        return os.path.join(self.save_dir, '.camera_states', state_name)
+        
+    def camera_state(self, pt):
+        """ a json-serializable record of everything that determines a frame's image """
+        state = {'resolution': [int(res) for res in self.resolution], 'sigma_clip': self.sigma_clip}
+        for key in ('cam_position', 'cam_width', 'north_vector', 'focus'):
+            state[key] = [float(val) for val in np.asarray(pt[key]).ravel()]
+            if hasattr(pt[key], 'units'):
+                state[key + '_units'] = str(pt[key].units)
+        return state
+        
+    def frame_is_current(self, pt):
+        """ True if a frame's image exists and was rendered with the current camera state """
+        state_file = self._state_file(pt)
+        if os.path.isfile(self.frame_file(pt)) is False or os.path.isfile(state_file) is False:
+            return False
+        with open(state_file) as sfi:
+            return json.load(sfi) == self.camera_state(pt)
+            
+    def _record_state(self, pt):
+        state_file = self._state_file(pt)
+        os.makedirs(os.path.dirname(state_file), exist_ok=True)
+        with open(state_file + '.tmp', 'w') as sfi:
+            json.dump(self.camera_state(pt), sfi)
+        os.replace(state_file + '.tmp', state_file)
+        
+    def render(self, workers = 1, scene_factory = None, resume = False, pre_frame = None, post_frame = None):
+        """ steps through and renders each frame of the flight path 
+
+        Parameters
+        ----------
+        workers : int
+            number of processes to render with (default 1, renders serially on self.sc). 
+        scene_factory : callable
+            required when workers > 1: a picklable callable with no arguments that 
+            returns the yt scene to render, e.g., a module-level function or a 
+            functools.partial. It is called once in each worker process.
+        resume : bool
+            if True, skip frames whose image already exists and was rendered with the 
+            same camera state (default False). After changing an anchor point, only 
+            the frames whose camera settings changed are rendered again.
+        pre_frame : callable
+            if not None, called as pre_frame(animator, pt) before each frame is rendered
+        post_frame : callable
+            if not None, called as post_frame(animator, pt, timing) after each frame is 
+            saved, where timing is the frame's entry in self.frame_timings. 
+            
+        With workers > 1 the flight path is split into one contiguous chunk per
+        worker, so the (often expensive) scene construction happens once per worker.
+        Frame numbering and file names are the same as for the serial render.
+        pre_frame and post_frame must then be picklable and are called in the worker
+        processes. Streaming to a video_file requires workers = 1; with resume,
+        up-to-date frames are read back from their pngs into the video.
+        """
+        self.frame_timings = []
+        skip = set()
+        if resume:
+            skip = {pt['frame'] for pt in self.flight_path if self.frame_is_current(pt)}
+            print(f"resuming: {len(skip)} of {len(self.flight_path)} frames are up to date")
+        frames = [pt for pt in self.flight_path if pt['frame'] not in skip]
+
+        if self.video_file is not None:
+            if workers > 1:
+                raise ValueError("streaming to a video_file requires workers = 1")
+            self._video = video_stream(self.video_file, fps=self.fps, max_queued=self.max_queued_frames)
+            try:
+                self._render_frames(self.flight_path, len(self.flight_path), pre_frame, post_frame, skip)
+            finally:
+                self._video.close()
+                self._video = None
+        elif len(frames) == 0:
+            return
+        elif workers > 1:
+            if scene_factory is None:
+                raise ValueError("a scene_factory is required to render with workers > 1")
+            self._render_parallel(frames, workers, scene_factory, pre_frame, post_frame)
+        else:
+            self._render_frames(frames, len(self.flight_path), pre_frame, post_frame)
+            
+    def preview(self, fraction = 0.25, workers = 1, scene_factory = None, every = 1, columns = None,
+                gif_file = None):
+        """ renders the flight path at a fraction of the resolution and assembles the
+        frames into a contact sheet, to check the camera path before the final render
+
+        Parameters
+        ----------
+        fraction : float
+            fraction of self.resolution to render the preview frames at (default 0.25)
+        workers : int
+            number of processes to render with, see render (default 1, renders
+            serially on self.sc)
+        scene_factory : callable
+            required when workers > 1, see render
+        every : int
+            only preview every n-th frame of the flight path (default 1, all frames)
+        columns : int
+            number of frames per row of the contact sheet (default None, about square)
+        gif_file : str
+            if not None, the preview frames are also saved to this animated gif, at
+            self.fps frames per second
+
+        Returns
+        -------
+        the file name of the contact sheet
+
+        Preview frames are saved to save_dir/preview/ and the contact sheet to
+        save_dir/preview/<base_name>contact_sheet.png. The preview does not change
+        the settings of this animator, so the final, full-resolution frames are
+        rendered by a following call to render() on the same scene, e.g.,
+
+        FA = flight_animator(sc, FP0.flight_path, resolution=(1200,1200))
+        FA.preview(0.1, workers=4, scene_factory=build_scene)
+        FA.render()
+        """
+        frames = self.flight_path[::every]
+        resolution = tuple(max(int(res * fraction), 2) for res in self.resolution)
+        settings = dict(self._settings(), save_dir=os.path.join(self.save_dir, 'preview'),
+                        resolution=resolution, save_png=True)
+        os.makedirs(settings['save_dir'], exist_ok=True)
+        preview = flight_animator(self.sc, frames, **settings)
+        preview.frame_offset = self.frame_offset
+        preview.render(workers=workers, scene_factory=scene_factory)
+
+        images = [_read_png(preview.frame_file(pt)) for pt in frames]
+        sheet_file = os.path.join(preview.save_dir, self.base_name + 'contact_sheet.png')
+        write_bitmap(_contact_sheet(images, columns), sheet_file)
+        print(f"saved contact sheet of {len(images)} frames to {sheet_file}")
+        if gif_file is not None:
+            from PIL import Image
+            gif_frames = [Image.fromarray(im[:, :, :3]) for im in images]
+            gif_frames[0].save(gif_file, save_all=True, append_images=gif_frames[1:],
+                               duration=int(1000 / self.fps), loop=0)
+        return sheet_file
+
+    def _render_frames(self, frames, total_frames, pre_frame = None, post_frame = None, skip = ()):
+        # renders a list of flight path frames on self.sc. Frame numbers in skip are not 
+        # rendered, but are read from their png if streaming to a video.
+        self.sc.camera.resolution = self.resolution
+        for pt in frames:
+            if pt['frame'] in skip:
+                if self._video is not None:
+                    self._video.write(_read_png(self.frame_file(pt)))
+                continue
             print(f"\nRendering frame {pt['frame']-self.frame_offset} of {total_frames}")
-            frame_name = self.base_name + str(pt['frame']).zfill(self.zfill_digs) + '.png'
-            save_name = os.path.join(self.save_dir,frame_name)
-            cam.set_position(pt['cam_position'], pt['north_vector'])
-            cam.set_width(pt['cam_width'])
-            cam.focus = pt['focus']
-            if self.sigma_clip:
-                self.sc.save(save_name, sigma_clip = self.sigma_clip)
-            else:
-                self.sc.save(save_name)
-            
\ No newline at end of file
+            if pre_frame is not None:
+                pre_frame(self, pt)
+            timing = self._render_frame(pt)
+            if self.save_png:
+                self._record_state(pt)
+            self.frame_timings.append(timing)
+            if post_frame is not None:
+                post_frame(self, pt, timing)
+                
+    def _render_frame(self, pt):
+        # renders and saves a single frame, returns the wall time of each stage. This 
+        # is the same image pipeline as sc.save(save_name, sigma_clip=sigma_clip), 
+        # split up so that each stage can be timed. 
+        cam = self.sc.camera
+        timing = {'frame': pt['frame']}
+        t_start = time.perf_counter()
+        
+        # the focus setter re-orients the camera from its previous north vector, so 
+        # set the position (and north vector) last for the orientation to only 
+        # depend on this frame, whichever frame was rendered before it
+        cam.set_width(pt['cam_width'])
+        cam.focus = pt['focus']
+        cam.set_position(pt['cam_position'], pt['north_vector'])
+        t_camera = time.perf_counter()
+        
+        im = self.sc.render()
+        t_render = time.perf_counter()
+        
+        rgba = _rgba_buffer(im, self.sigma_clip if self.sigma_clip else None)
+        t_clip = time.perf_counter()
+        
+        if self.save_png:
+            write_bitmap(rgba, self.frame_file(pt))
+        if self._video is not None:
+            self._video.write(rgba)
+        t_encode = time.perf_counter()
+        
+        timing['camera'] = t_camera - t_start
+        timing['render'] = t_render - t_camera
+        timing['clip'] = t_clip - t_render
+        timing['encode'] = t_encode - t_clip
+        timing['total'] = t_encode - t_start
+        return timing
+        
+    def write_timing_report(self, fname):
+        """ writes self.frame_timings to a .csv or .json file 
+
+        Parameters
+        ----------
+        fname : str
+            the file to write, the format is set by the extension (.csv or .json). 
+            
+        Each row has the frame number and the wall time in seconds of each stage: 
+        'camera' (camera updates), 'render' (volume/mesh traversal), 'clip' (rescaling 
+        and sigma clipping), 'encode' (png encoding and writing and/or handing the 
+        frame to the video encoder) and 'total'. The json 
+        report also includes the per-stage totals over all frames.
+        """
+        stages = ('camera', 'render', 'clip', 'encode', 'total')
+        if fname.endswith('.csv'):
+            with open(fname, 'w', newline='') as rfi:
+                writer = csv.DictWriter(rfi, fieldnames=('frame',) + stages)
+                writer.writeheader()
+                writer.writerows(self.frame_timings)
+        elif fname.endswith('.json'):
+            totals = {stage: sum([timing[stage] for timing in self.frame_timings]) for stage in stages}
+            with open(fname, 'w') as rfi:
+                json.dump({'frames': self.frame_timings, 'totals': totals}, rfi, indent=1)
+        else:
+            raise ValueError(f"timing report must be a .csv or .json file, got {fname}")
+                
+    def _render_parallel(self, frames, workers, scene_factory, pre_frame, post_frame):
+        # splits the frames into a contiguous chunk per worker 
+        n_frames = len(frames)
+        chunk_edges = np.linspace(0, n_frames, min(workers, n_frames) + 1).astype(int)
+        chunks = [frames[i0:i1] for i0, i1 in zip(chunk_edges[:-1], chunk_edges[1:])]
+        with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+            futures = [pool.submit(_render_chunk, scene_factory, chunk, self._settings(), 
+                                   self.frame_offset, len(self.flight_path), pre_frame, post_frame) 
+                       for chunk in chunks]
+            for future in futures:
+                self.frame_timings.extend(future.result())
+
+
+def _render_chunk(scene_factory, frames, settings, frame_offset, total_frames, pre_frame, post_frame):
+    # renders a chunk of a flight path in a worker process on a freshly built scene, 
+    # returns the frame timings 
+    animator = flight_animator(scene_factory(), frames, **settings)
+    animator.frame_offset = frame_offset
+    animator._render_frames(frames, total_frames, pre_frame, post_frame)
+    return animator.frame_timings
+
+
+class video_stream(object):
+    '''
+    encodes a sequence of uint8 RGBA frames into a video by piping the raw image 
+    buffers to an ffmpeg subprocess. Frames are handed to a writer thread through 
+    a bounded queue, so rendering and encoding overlap while memory stays flat. 
+    
+    Parameters
+        ----------
+        fname : str
+            the video file to write, the container is set by the extension (e.g., .mp4)
+        fps : int
+            frames per second (default 15)
+        max_queued : int
+            maximum number of frames waiting to be encoded, write() blocks when the 
+            queue is full (default 4)
+        ffmpeg : str
+            the ffmpeg executable (default 'ffmpeg')
+        output_args : tuple
+            ffmpeg output arguments, the default encodes h264 with even frame dimensions
+            
+    The ffmpeg process starts on the first write(), which sets the frame size. Call 
+    close() after the last frame.
+    '''
+    def __init__(self, fname, fps = 15, max_queued = 4, ffmpeg = 'ffmpeg', 
+                 output_args = ('-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p')):
+        self.fname = fname
+        self.fps = fps
+        self.ffmpeg = ffmpeg
+        self.output_args = output_args
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._proc = None
+        self._thread = None
+        self._error = None
+        
+    def _start(self, shape):
+        cmd = [self.ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba', 
+               '-s', f"{shape[1]}x{shape[0]}", '-r', str(self.fps), '-i', '-'] 
+        cmd += list(self.output_args) + [self.fname]
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        self._thread = threading.Thread(target=self._write_frames, daemon=True)
+        self._thread.start()
+        
+    def _write_frames(self):
+        # writer thread: pipes queued frames to ffmpeg until it gets None
+        while True:
+            rgba = self._queue.get()
+            if rgba is None:
+                break
+            if self._error is None:
+                try:
+                    self._proc.stdin.write(rgba.tobytes())
+                except OSError as err:
+                    self._error = err
+                    
+    def write(self, rgba):
+        """ queues a (height, width, 4) uint8 frame for encoding """
+        if self._proc is None:
+            self._start(rgba.shape)
+        if self._error is not None:
+            raise RuntimeError(f"video encoding of {self.fname} failed: {self._error}")
+        self._queue.put(np.ascontiguousarray(rgba))
+        
+    def close(self):
+        """ waits for the queued frames to be encoded and finalizes the video file """
+        if self._proc is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._proc.stdin.close()
+        returncode = self._proc.wait()
+        self._proc = None
+        if self._error is not None or returncode != 0:
+            raise RuntimeError(f"video encoding of {self.fname} failed (ffmpeg exit code {returncode})")
+
+
+def _read_png(fname):
+    # reads a saved frame back into a uint8 RGBA array
+    from matplotlib.image import imread
+    rgba = imread(fname)
+    if rgba.dtype != np.uint8:
+        rgba = np.round(rgba * 255).astype('uint8')
+    if rgba.shape[-1] == 3:
+        rgba = np.concatenate([rgba, np.full(rgba.shape[:2] + (1,), 255, dtype='uint8')], axis=-1)
+    return rgba
+
+
+def _contact_sheet(images, columns = None):
+    # tiles a list of equally sized uint8 RGBA frames into one image, row by row, on
+    # a black background
+    if columns is None:
+        columns = int(np.ceil(np.sqrt(len(images))))
+    rows = int(np.ceil(len(images) / columns))
+    height, width = images[0].shape[:2]
+    sheet = np.zeros((rows * height, columns * width, 4), dtype='uint8')
+    sheet[:, :, 3] = 255
+    for i_im, im in enumerate(images):
+        row, col = divmod(i_im, columns)
+        sheet[row * height:(row + 1) * height, col * width:(col + 1) * width] = im
+    return sheet
+
+
+def _rgba_buffer(im, sigma_clip = None):
+    # converts a rendered ImageArray to the uint8 RGBA array that sc.save writes to png: 
+    # rescaled, on a black background, optionally sigma clipped and in image orientation
+    out = im.rescale(inline=False).add_background_color('black', inline=False)
+    if sigma_clip is not None:
+        max_val = im._clipping_value(sigma_clip, im=out)
+    else:
+        max_val = out[:, :, :3].max()
+        if max_val == 0.:
+            max_val = 1.
+    out = out.swapaxes(0, 1)
+    alpha = (255 * out[:, :, 3]).astype('uint8')
+    rgb = (np.clip(out[:, :, :3] / max_val, 0., 1.) * 255).astype('uint8')
+    return np.concatenate([rgb, alpha[..., None]], axis=-1)
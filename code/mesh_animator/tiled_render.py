@@ -0,0 +1,152 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from yt.data_objects.image_array import ImageArray
+from yt.visualization.image_writer import write_bitmap
+from yt.visualization.volume_rendering.lens import PlaneParallelLens
+from .mesh_animator import _rgba_buffer
+
+# the scene of a tile worker process and the per-tile setup, set by _init_tile_worker
+_tile_scene = None
+_tile_setup = None
+
+
+def render_tiled(scene_factory, fname = None, resolution = None, tiles = (2, 2), workers = 1, sigma_clip = None,
+                 tile_setup = None):
+    """ renders a high resolution image of a scene as a grid of tiles and stitches them
+
+    Parameters
+    ----------
+    scene_factory : callable
+        a picklable callable with no arguments that returns the yt scene to render,
+        e.g., a module-level function or a functools.partial. It is called once in
+        each worker process. The scene must use the (default) plane-parallel lens.
+    fname : str
+        png file to save the stitched image to (default None, does not save)
+    resolution : tuple
+        resolution of the full image (default None, the resolution of the camera
+        returned by scene_factory)
+    tiles : int or tuple
+        number of tiles along each image axis (default (2, 2))
+    workers : int
+        number of processes to render the tiles with (default 1, renders serially
+        in this process)
+    sigma_clip : None or float
+        sigma clipping of the stitched image, same as sc.save(fname, sigma_clip=sigma_clip)
+    tile_setup : callable
+        if not None, a picklable callable called as tile_setup(scene) in the worker
+        once the camera is set to a tile, before the tile is rendered. E.g., to swap
+        in sources that only hold the data in view of the tile camera.
+
+    Returns
+    -------
+    the stitched uint8 RGBA array, as written to fname
+
+    Each tile is rendered by a sub-camera covering its part of the image plane, so a
+    worker only holds the image buffers of a single tile. The raw tiles are stitched
+    before rescaling and sigma clipping, so the result matches rendering the full
+    image in one pass. Every worker builds its own scene, so unless tile_setup limits
+    the sources to the tile, each worker holds all of the data the scene renders
+    and memory grows with the number of workers.
+
+    e.g.,
+
+    def build_scene():
+        ds = yt.load(...)
+        return yt.create_scene(ds, 'dbz')
+
+    render_tiled(build_scene, 'highres.png', resolution=(4000, 4000), tiles=(4, 4), workers=4)
+    """
+    if np.isscalar(tiles):
+        tiles = (tiles, tiles)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_tile_worker,
+                                 initargs=(scene_factory, tile_setup)) as pool:
+            camera = pool.submit(_camera_state).result()
+            if resolution is None:
+                resolution = camera['resolution']
+            tile_list = _tile_layout(resolution, tiles)
+            results = pool.map(_render_tile, tile_list, [camera] * len(tile_list),
+                               [resolution] * len(tile_list))
+            im = _stitch(results, resolution)
+    else:
+        _init_tile_worker(scene_factory, tile_setup)
+        camera = _camera_state()
+        if resolution is None:
+            resolution = camera['resolution']
+        tile_list = _tile_layout(resolution, tiles)
+        im = _stitch((_render_tile(tile, camera, resolution) for tile in tile_list), resolution)
+
+    rgba = _rgba_buffer(im, sigma_clip)
+    if fname is not None:
+        write_bitmap(rgba, fname)
+    return rgba
+
+
+def _init_tile_worker(scene_factory, tile_setup = None):
+    global _tile_scene, _tile_setup
+    _tile_scene = scene_factory()
+    _tile_setup = tile_setup
+    lens = _tile_scene.camera.lens
+    if not isinstance(lens, PlaneParallelLens):
+        raise ValueError(f"tiled rendering requires a plane-parallel lens, got {type(lens).__name__}")
+
+
+def _camera_state():
+    # the full-image camera settings, in code_length
+    cam = _tile_scene.camera
+    return {'position': cam.position.in_units('code_length').d,
+            'focus': cam.focus.in_units('code_length').d,
+            'width': cam.width.in_units('code_length').d,
+            'north_vector': np.array(cam.north_vector),
+            'unit_vectors': np.array(cam.unit_vectors),
+            'resolution': tuple(cam.resolution)}
+
+
+def _tile_layout(resolution, tiles):
+    # the pixel ranges ((i0, i1), (j0, j1)) of each tile
+    if resolution[0] < 2 * tiles[0] or resolution[1] < 2 * tiles[1]:
+        raise ValueError(f"tiles must be at least 2 pixels wide, got {tiles} tiles for resolution {resolution}")
+    i_edges = np.linspace(0, resolution[0], tiles[0] + 1).astype(int)
+    j_edges = np.linspace(0, resolution[1], tiles[1] + 1).astype(int)
+    return [((i0, i1), (j0, j1)) for i0, i1 in zip(i_edges[:-1], i_edges[1:])
+            for j0, j1 in zip(j_edges[:-1], j_edges[1:])]
+
+
+def _render_tile(tile, camera, resolution):
+    # renders one tile with a sub-camera that covers its pixels of the full image
+    # plane, returns the tile and its raw image
+    t_start = time.perf_counter()
+    (i0, i1), (j0, j1) = tile
+    cam = _tile_scene.camera
+    # yt samples pixel i of an n pixel image at width * (i / (n - 1) - 0.5), so a tile
+    # spans (n_tile - 1) full-image pixel spacings, centered on its middle pixel
+    full_width = camera['width']
+    spacing = full_width[:2] / (np.array(resolution) - 1.)
+    width = full_width.copy()
+    width[0] = spacing[0] * (i1 - i0 - 1)
+    width[1] = spacing[1] * (j1 - j0 - 1)
+    # offset of the tile center from the image center, pixel indices run against
+    # the camera unit vectors
+    offset = ((full_width[0] / 2. - spacing[0] * (i0 + i1 - 1) / 2.) * camera['unit_vectors'][0] +
+              (full_width[1] / 2. - spacing[1] * (j0 + j1 - 1) / 2.) * camera['unit_vectors'][1])
+
+    # each camera setter re-orients the camera, so the focus goes first and the
+    # position last, with the original north vector
+    cam.set_resolution((i1 - i0, j1 - j0))
+    cam.set_width(_tile_scene.arr(width, 'code_length'))
+    cam.focus = _tile_scene.arr(camera['focus'] + offset, 'code_length')
+    cam.set_position(_tile_scene.arr(camera['position'] + offset, 'code_length'), camera['north_vector'])
+    if _tile_setup is not None:
+        _tile_setup(_tile_scene)
+    im = np.asarray(_tile_scene.render())
+    print(f"rendered tile {tile} in {time.perf_counter() - t_start:.1f} s")
+    return tile, im
+
+
+def _stitch(results, resolution):
+    im = np.zeros((resolution[0], resolution[1], 4))
+    for ((i0, i1), (j0, j1)), tile_im in results:
+        im[i0:i1, j0:j1, :] = tile_im
+    return ImageArray(im)
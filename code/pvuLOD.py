@@ -0,0 +1,181 @@
+import os
+import json
+import numpy as np
+
+# VTK hexahedron vertex slot of each octant of an element, indexed by
+# (x above centroid) + 2*(y above centroid) + 4*(z above centroid)
+_octant_slot = np.array([0, 1, 3, 2, 4, 5, 7, 6])
+
+# (i, j, k) offsets of the corners of a VTK hexahedron, in vertex order
+_hex_corners = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+                         [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]])
+
+
+class lodLevel(object):
+    """ a single coarsened mesh, with the same attributes as a loaded pvuFile """
+    def __init__(self, factor, connectivity, coordinates, node_data):
+        self.factor = factor
+        self.connectivity = connectivity
+        self.coordinates = coordinates
+        self.node_data = node_data
+
+
+class pvuLOD(object):
+    """
+    builds coarsened (level-of-detail) copies of a loaded pvuFile for quick previews.
+
+    Parameters
+    ----------
+    pvu : pvuFile
+        a loaded pvuFile with hexahedral elements
+    fields : list of str
+        node_data field names to carry over to the coarse meshes (default None, all
+        fields in the first piece's node_data)
+    cache_dir : str
+        directory for the on-disk cache of the levels. Default None uses
+        pvu.cache_dir + '.lod', set to False to only cache levels in memory.
+
+    Level `factor` agglomerates the elements into bins `factor` times the median
+    element size along each axis: every bin containing an element centroid becomes
+    one hexahedral element. The value at each corner of a coarse element is the mean
+    of the member elements' values at the vertices in that corner's octant, and the
+    global minimum and maximum of each field are written back to the corners they
+    fall in, so field ranges (and color bounds) match the full-resolution mesh.
+    Levels are one mesh ('connect1').
+
+    e.g.,
+
+    lod = pvuLOD(pvuData, fields=['strain_rate'])
+    coarse = lod.level(4)
+    ds = yt.load_unstructured_mesh(coarse.connectivity, coarse.coordinates,
+                                   node_data=coarse.node_data, length_unit="m")
+    """
+    def __init__(self, pvu, fields=None, cache_dir=None):
+        self.pvu = pvu
+        if fields is None:
+            fields = [fld_name for _, fld_name in pvu.node_data[0].keys()]
+        self.fields = list(fields)
+        if cache_dir is None:
+            cache_dir = pvu.cache_dir + '.lod'
+        self.cache_dir = cache_dir
+        self._levels = {}
+
+    @property
+    def levels(self):
+        """ the coarsening factors of the levels built so far """
+        return sorted(self._levels.keys())
+
+    def level(self, factor):
+        """ returns the lodLevel coarsened by factor, building it if needed
+
+        Parameters
+        ----------
+        factor : int
+            coarsening factor along each axis, 1 returns the full-resolution pvuFile
+        """
+        if factor == 1:
+            return self.pvu
+        if factor not in self._levels:
+            lvl = self._read_cache(factor)
+            if lvl is None:
+                lvl = self._build(factor)
+                self._write_cache(lvl)
+            self._levels[factor] = lvl
+        return self._levels[factor]
+
+    def build(self, factors=(2, 4, 8)):
+        """ builds (or reads from the cache) several levels at once """
+        return [self.level(factor) for factor in factors]
+
+    def _build(self, factor):
+        print(f"building level of detail {factor}")
+        coords = np.asarray(self.pvu.coordinates)
+        n_verts = self.pvu.connectivity[0].shape[1]
+        if n_verts != 8:
+            raise ValueError(f"level of detail requires hexahedral elements, got {n_verts} nodes per element")
+
+        # centroid, octant slot of each vertex and extent of every element, by piece
+        centroids, slots, extents = [], [], []
+        for con in self.pvu.connectivity:
+            vert_coords = coords[con]
+            centroid = vert_coords.mean(axis=1)
+            above = vert_coords > centroid[:, None, :]
+            slots.append(_octant_slot[above[:, :, 0] + 2 * above[:, :, 1] + 4 * above[:, :, 2]])
+            extents.append(vert_coords.max(axis=1) - vert_coords.min(axis=1))
+            centroids.append(centroid)
+        centroids = np.concatenate(centroids)
+        slots = np.concatenate(slots)
+        extents = np.concatenate(extents)
+
+        # bin the element centroids
+        left_edge = coords.min(axis=0)
+        right_edge = coords.max(axis=0)
+        bin_size = np.median(extents, axis=0) * factor
+        n_bins = np.maximum(np.ceil((right_edge - left_edge) / bin_size).astype('i8'), 1)
+        bin_ijk = np.clip(((centroids - left_edge) / bin_size).astype('i8'), 0, n_bins - 1)
+        bin_id = np.ravel_multi_index(bin_ijk.T, n_bins)
+        occupied, element_bin = np.unique(bin_id, return_inverse=True)
+        element_bin = element_bin.ravel()
+        del centroids, extents
+
+        # one hexahedron per occupied bin, on the shared bin-corner grid
+        occupied_ijk = np.stack(np.unravel_index(occupied, n_bins), axis=1)
+        corner_ijk = occupied_ijk[:, None, :] + _hex_corners[None, :, :]
+        corner_id = np.ravel_multi_index(corner_ijk.reshape(-1, 3).T, n_bins + 1)
+        nodes, connectivity = np.unique(corner_id, return_inverse=True)
+        connectivity = connectivity.reshape(-1, 8).astype('i8')
+        node_ijk = np.stack(np.unravel_index(nodes, n_bins + 1), axis=1)
+        coordinates = np.minimum(left_edge + node_ijk * bin_size, right_edge)
+
+        # average the vertex values of the member elements into the bin corners
+        flat_slot = (element_bin[:, None] * 8 + slots).ravel()
+        counts = np.bincount(flat_slot, minlength=occupied.size * 8)
+        node_data = {}
+        for fld_name in self.fields:
+            vals = np.concatenate([np.asarray(node_d[(_mesh_name(mesh_id), fld_name)])
+                                   for mesh_id, node_d in enumerate(self.pvu.node_data)]).ravel()
+            sums = np.bincount(flat_slot, weights=vals, minlength=occupied.size * 8)
+            coarse = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+            # corners no member vertex fell into get the mean of the bin
+            bin_mean = (sums.reshape(-1, 8).sum(axis=1) / counts.reshape(-1, 8).sum(axis=1))
+            empty = counts == 0
+            coarse[empty] = np.repeat(bin_mean, 8)[empty]
+            # preserve the field range
+            coarse[flat_slot[np.argmin(vals)]] = vals.min()
+            coarse[flat_slot[np.argmax(vals)]] = vals.max()
+            node_data[('connect1', fld_name)] = coarse.reshape(-1, 8)
+
+        n_full = slots.shape[0]
+        print(f"level {factor}: {n_full} -> {connectivity.shape[0]} elements")
+        return lodLevel(factor, [connectivity], coordinates, [node_data])
+
+    def _cache_file(self, factor):
+        return os.path.join(self.cache_dir, f"lod_{factor}.npz")
+
+    def _cache_key(self, factor):
+        return json.dumps([self.pvu._cache_key(), factor, sorted(self.fields),
+                           int(np.asarray(self.pvu.coordinates).shape[0])])
+
+    def _read_cache(self, factor):
+        if self.cache_dir is False or os.path.isfile(self._cache_file(factor)) is False:
+            return None
+        with np.load(self._cache_file(factor)) as cached:
+            if str(cached['key']) != self._cache_key(factor):
+                return None
+            node_data = {('connect1', fld_name): cached['node_' + str(i)]
+                         for i, fld_name in enumerate(self.fields)}
+            return lodLevel(factor, [cached['connectivity']], cached['coordinates'], [node_data])
+
+    def _write_cache(self, lvl):
+        if self.cache_dir is False:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        node_arrays = {'node_' + str(i): lvl.node_data[0][('connect1', fld_name)]
+                       for i, fld_name in enumerate(self.fields)}
+        np.savez(self._cache_file(lvl.factor), key=self._cache_key(lvl.factor),
+                 connectivity=lvl.connectivity[0], coordinates=lvl.coordinates, **node_arrays)
+
+
+def _mesh_name(mesh_id):
+    # node_data mesh name of a piece, connect1, connect2, etc.
+    return "connect{meshnum}".format(meshnum=mesh_id + 1)
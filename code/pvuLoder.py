@@ -1,4 +1,14 @@
+import glob
+import hashlib
+import json
 import os 
+import re
+import shutil
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections.abc import Mapping
+from functools import partial
+from itertools import repeat
 import numpy as np
 import xmltodict, meshio
 
@@ -6,83 +16,717 @@ class pvuFile(object):
     def __init__(self,file,**kwargs):
         self.file=file 
         self.dataDir=kwargs.get('dataDir',os.path.split(file)[0])
+        pvtu_name=os.path.splitext(os.path.basename(file))[0]
+        self.cache_dir=kwargs.get('cache_dir',os.path.join(self.dataDir,'.pvu_cache',pvtu_name))
+        self.index_file=kwargs.get('index_file',self.cache_dir+'.index.json')
         with open(file) as data:
             self.pXML = xmltodict.parse(data.read())
             
         # store fields for convenience 
         self.fields=self.pXML['VTKFile']['PUnstructuredGrid']['PPointData']['PDataArray']     
+        if not isinstance(self.fields,list):
+            self.fields = [self.fields]
         
         self.connectivity = None
         self.coordinates = None
         self.node_data = None
+        self._point_data = {} # global per-node arrays backing lazily gathered fields 
+        self._lazy_connectivity = None # connectivity of the lazy fields, if nodes were merged
+        self.piece_bounds = None
             
-    def load(self):                      
-    
-        conlist=[]  # list of 2D connectivity arrays 
-        coordlist=[] # global, concatenated coordinate array 
-        nodeDictList=[] # list of node_data dicts, same length as conlist 
+    def load(self,workers=1,use_threads=False,trace_memory=False,fields=None,lazy=False,use_cache=False,
+             merge_nodes=False,box=None,plane=None,flight_path=None,flight_path_units='m'):
+        """ loads all the .vtu pieces listed in the .pvtu file 
+
+        Parameters
+        ----------
+        workers : int
+            number of pieces to read and parse concurrently (default 1, reads serially)
+        use_threads : bool
+            if True, use a thread pool instead of a process pool when workers > 1 
+            (default False). 
+        trace_memory : bool
+            if True, track the peak memory allocated in this process during the load 
+            with tracemalloc and store it in self.peak_memory (bytes). Default False.
+        fields : list of str
+            the fields to gather into node_data, by .pvtu name (e.g., 'velocity') or 
+            by component name (e.g., 'velocity_cx'). Default None loads all fields.
+        lazy : bool
+            if True, fields not in `fields` are kept as per-node arrays and only 
+            gathered into per-element arrays the first time they are indexed in 
+            node_data or requested from get_node_data (default False, unrequested 
+            fields are dropped). Iterating over node_data, as yt does, skips them, 
+            see lazyNodeData.
+        use_cache : bool
+            if True, load from the binary cache in self.cache_dir, building it first 
+            if it is missing or out of date (default False). See load_cache. If the 
+            cache cannot be written (e.g., the data directory is read-only), the 
+            .vtu files are read instead: pass cache_dir to pvuFile to put it elsewhere.
+        merge_nodes : bool
+            if True, merge the nodes duplicated on piece boundaries after loading 
+            (default False). See merge_nodes.
+        box : tuple
+            if not None, a (left_edge, right_edge) box: only the pieces whose bounding 
+            box intersects it are loaded. See select_pieces.
+        plane : tuple
+            if not None, an (axis, coordinate) plane, e.g., ('z', 4e5): only the pieces 
+            that intersect the plane are loaded. See select_pieces.
+        flight_path : mesh_animator.flight_path
+            if not None, only the pieces visible in at least one frame of the flight 
+            path are loaded, see flight_path.visible_boxes.
+        flight_path_units : str
+            the length units of the mesh coordinates, used to convert the flight path 
+            (default 'm'). 
+
+        Pieces are read in parallel but connectivity offsets are applied in piece 
+        order, so the result is identical to the serial load. The global coordinate 
+        and connectivity arrays are sized from the .vtu piece headers and filled in 
+        place as each piece arrives. 
 
-        con_offset=-1
+        Note that yt.load_unstructured_mesh copies every entry of node_data when 
+        building a dataset, so pass only the fields you need to yt, e.g., 
+        node_data=pvuData.get_node_data(['strain_rate']). 
+        
+        When loading a box or plane, the selected pieces are numbered consecutively 
+        (connect1, connect2, ...). With use_cache, they are sliced out of a valid 
+        cache, otherwise only the selected .vtu files are read (the full cache is 
+        not built).
+        """
+        if trace_memory:
+            tracemalloc.start()
+            
+        piece_ids=None
+        boxes=None
+        if flight_path is not None:
+            bounds=self.piece_index(workers=workers,use_threads=use_threads)
+            extent=[bounds[:,0,:].min(axis=0),bounds[:,1,:].max(axis=0)]
+            boxes=flight_path.visible_boxes(units=flight_path_units,extent=extent)
+        if box is not None or plane is not None or boxes is not None:
+            piece_ids=self.select_pieces(box=box,plane=plane,boxes=boxes,workers=workers,use_threads=use_threads)
+            if len(piece_ids) == 0:
+                raise ValueError("no pieces of the mesh intersect the selected box, plane or flight path")
+            print(f"loading {len(piece_ids)} of {len(self._source_files())} pieces")
+            
+        if use_cache and piece_ids is None and self.cache_is_valid() is False:
+            try:
+                self.build_cache(workers=workers,use_threads=use_threads)
+            except OSError as err:
+                print(f"could not write the cache to {self.cache_dir} ({err}), reading the .vtu files")
+        if use_cache and self.cache_is_valid():
+            self.load_cache(fields=fields,piece_ids=piece_ids)
+        else:
+            self._load_pieces(workers,use_threads,fields,lazy,piece_ids)
+            
+        if merge_nodes:
+            self.merge_nodes()
+            
+        if trace_memory:
+            self.peak_memory=tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"peak memory during load: {self.peak_memory/1e6:.1f} MB")
+            
+    def _source_files(self):
+        # full paths to the .vtu files listed in the .pvtu file 
         pieces = self.pXML['VTKFile']['PUnstructuredGrid']['Piece']
         if not isinstance(pieces,list):
             pieces = [pieces]
             
-        for mesh_id,src in enumerate(pieces): 
-            print(f"processing {mesh_id} of {pieces} vtu files")
-            mesh_name="connect{meshnum}".format(meshnum=mesh_id+1) # connect1, connect2, etc.  
+        return [os.path.join(self.dataDir,src['@Source']) for src in pieces]
+            
+    def _load_pieces(self,workers,use_threads,fields,lazy,piece_ids=None):
+        srcFiles=self._source_files()
+        if piece_ids is not None:
+            srcFiles=[srcFiles[piece_id] for piece_id in piece_ids]
+        mesh_names=["connect{meshnum}".format(meshnum=mesh_id+1) for mesh_id in range(len(srcFiles))] # connect1, connect2, etc.  
+        
+        # size of each piece from the .vtu headers, (None, None) if the header can't be read  
+        piece_sizes=[_read_piece_header(srcFi) for srcFi in srcFiles]
+        
+        if workers > 1: 
+            print(f"processing {len(srcFiles)} vtu files with {workers} workers")
+            Pool = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+            with Pool(max_workers=workers) as pool:
+                piece_data=pool.map(_read_piece,srcFiles,mesh_names,repeat(self.fields),repeat(fields),repeat(lazy))
+                self._assemble(piece_data,piece_sizes,mesh_names)
+        else:
+            def _serial_pieces():
+                for mesh_id,srcFi in enumerate(srcFiles): 
+                    print(f"processing {mesh_id} of {len(srcFiles)} vtu files")
+                    yield _read_piece(srcFi,mesh_names[mesh_id],self.fields,fields,lazy)
+            self._assemble(_serial_pieces(),piece_sizes,mesh_names)
             
-            srcFi=os.path.join(self.dataDir,src['@Source']) # full path to .vtu file 
+    def _assemble(self,piece_data,piece_sizes,mesh_names):
+        # fills the global coordinate and connectivity arrays from an iterable of pieces 
+        # (in piece order). Each piece's connectivity is offset by the number of points 
+        # in the preceding pieces. 
+        n_pts=[n for n,_ in piece_sizes]
+        n_cells=[n for _,n in piece_sizes]
+        if None in n_pts or None in n_cells:
+            # could not size from the headers: hold on to the pieces and size from them 
+            piece_data=list(piece_data)
+            n_pts=[piece[1].shape[0] for piece in piece_data]
+            n_cells=[piece[0].shape[0] for piece in piece_data]
+        
+        pt_starts=np.concatenate([[0],np.cumsum(n_pts)])
+        cell_starts=np.concatenate([[0],np.cumsum(n_cells)])
+        
+        self.coordinates=np.empty((pt_starts[-1],3),dtype="f8")
+        con_global=None # allocated once the number of nodes per element is known 
+        conlist=[]  # list of 2D connectivity arrays, views into con_global 
+        nodeDictList=[] # list of node_data dicts, same length as conlist 
+        self._point_data={}
+        self._lazy_connectivity=None
+        for mesh_id,(con,coord,node_d,raw_d) in enumerate(piece_data):
+            if con.shape[0] != n_cells[mesh_id] or coord.shape[0] != n_pts[mesh_id]:
+                raise ValueError(f"piece {mesh_id} does not match the size in its header")
+                
+            if con_global is None:
+                con_global=np.empty((cell_starts[-1],con.shape[1]),dtype="i8")
+            con_view=con_global[cell_starts[mesh_id]:cell_starts[mesh_id+1]]
+            np.add(con,pt_starts[mesh_id],out=con_view,casting="unsafe")
+            np.copyto(self.coordinates[pt_starts[mesh_id]:pt_starts[mesh_id+1]],coord)
             
-            [con,coord,node_d]=self.loadPiece(srcFi,mesh_name,con_offset+1)                        
-            con_offset=con.max() 
+            # per-node data of lazy fields go into global arrays, gathered on access 
+            gatherers={}
+            for fld_name,data1d in raw_d.items():
+                if fld_name not in self._point_data:
+                    self._point_data[fld_name]=np.empty((pt_starts[-1],),dtype=data1d.dtype)
+                np.copyto(self._point_data[fld_name][pt_starts[mesh_id]:pt_starts[mesh_id+1]],data1d)
+                gatherers[(mesh_names[mesh_id],fld_name)]=partial(self._gather,fld_name,mesh_id)
             
-            conlist.append(con.astype("i8"))
-            coordlist.extend(coord.astype("f8"))
-            nodeDictList.append(node_d)
+            conlist.append(con_view)
+            nodeDictList.append(lazyNodeData(node_d,gatherers) if gatherers else node_d)
             
-        print("concatenating data")
         self.connectivity=conlist
-        self.coordinates=np.array(coordlist)
         self.node_data=nodeDictList
+        self._connectivity_block=con_global
+        self._cell_starts=cell_starts
+        self._point_starts=pt_starts
+        
+    def merge_nodes(self,tol=None):
+        """ merges nodes that are shared between pieces into a single global node 
+
+        Parameters
+        ----------
+        tol : float
+            nodes are merged when their coordinates round to the same multiple of tol. 
+            Default None uses 1e-9 of the largest domain extent.
+
+        Each .vtu piece stores its own copy of the nodes on its partition boundaries. 
+        This builds a global node index from the rounded coordinates, keeps a single 
+        copy of each node and remaps the connectivity to it. node_data is per-element, 
+        so it is unchanged. The reduction is stored in self.merge_stats.
+
+        Lazy fields (see load) are not merged: the pieces may disagree on the value 
+        at a shared node, so they keep their per-piece nodes and are gathered through 
+        the connectivity from before the merge, as in a load without merge_nodes.
+        """
+        coords=np.asarray(self.coordinates)
+        if tol is None:
+            tol=np.ptp(coords,axis=0).max()*1e-9
+            tol=tol if tol > 0 else 1.
             
-    def loadPiece(self,srcFi,mesh_name,connectivity_offset=0): 
-        meshPiece=meshio.read(srcFi) # read it in with meshio     
-        coords=meshPiece.points # coords and node_data are already global
-        cell_type = list(meshPiece.cells_dict.keys())[0]
+        quantized=np.round(coords/tol).astype("i8")
+        _,first,inverse=np.unique(quantized,axis=0,return_index=True,return_inverse=True)
+        inverse=inverse.ravel()
+        del quantized
+        
+        nbytes_before=coords.nbytes+sum([pd.nbytes for pd in self._point_data.values()])
+        old_connectivity=self.connectivity
+        self.coordinates=coords[first]
+        self._connectivity_block=inverse[self._connectivity_block]
+        self.connectivity=[self._connectivity_block[self._cell_starts[mesh_id]:self._cell_starts[mesh_id+1]] 
+                           for mesh_id in range(len(self._cell_starts)-1)]
+        if len(self._point_data) and self._lazy_connectivity is None:
+            self._lazy_connectivity=old_connectivity
+        nbytes_after=self.coordinates.nbytes+sum([pd.nbytes for pd in self._point_data.values()])
+        if self._lazy_connectivity is not None:
+            nbytes_after+=sum([con.nbytes for con in self._lazy_connectivity])
+        
+        self.merge_stats={'nodes_before':coords.shape[0],'nodes_after':self.coordinates.shape[0],
+                          'bytes_before':nbytes_before,'bytes_after':nbytes_after}
+        print(f"merged nodes: {coords.shape[0]} -> {self.coordinates.shape[0]} "
+              f"({100.*(1-self.coordinates.shape[0]/coords.shape[0]):.1f}% fewer), "
+              f"node memory {nbytes_before/1e6:.1f} MB -> {nbytes_after/1e6:.1f} MB")
         
-        connectivity=meshPiece.cells_dict[cell_type] # 2D connectivity array 
+    def _gather(self,fld_name,mesh_id):
+        # per-element array of a lazy field for one piece 
+        connectivity=self.connectivity if self._lazy_connectivity is None else self._lazy_connectivity
+        return self._point_data[fld_name][connectivity[mesh_id]]
+        
+    def get_node_data(self,fields=None):
+        """ returns a list of plain node_data dicts with only the requested fields 
 
-        # parse node data 
-        node_data=self.parseNodeData(meshPiece.point_data,connectivity,mesh_name)
+        Parameters
+        ----------
+        fields : list of str
+            .pvtu field names or component names to include, default None includes 
+            every loaded (or lazily available) field. Lazy fields are gathered here.
+
+        The list can be passed directly to yt.load_unstructured_mesh as node_data.
+        """
+        node_data=[]
+        for node_d in self.node_data:
+            keys=node_d.available_keys() if isinstance(node_d,lazyNodeData) else node_d.keys()
+            node_data.append({m_F:node_d[m_F] for m_F in keys 
+                              if fields is None or _is_selected(m_F[1],fields,self.fields)})
+        return node_data
+            
+    def _cache_key(self):
+        # hash of the path, size and modification time of the .pvtu and all .vtu files 
+        stats=[]
+        for srcFi in [self.file]+self._source_files():
+            st=os.stat(srcFi)
+            stats.append([os.path.abspath(srcFi),st.st_size,st.st_mtime_ns])
+        return hashlib.sha1(json.dumps(stats).encode()).hexdigest()
+        
+    def _read_manifest(self):
+        manifest_file=os.path.join(self.cache_dir,'manifest.json')
+        if os.path.isfile(manifest_file) is False:
+            return None
+        with open(manifest_file) as mfi:
+            return json.load(mfi)
+        
+    def cache_is_valid(self):
+        """ True if the cache in self.cache_dir exists and matches the current source files """
+        manifest=self._read_manifest()
+        return manifest is not None and manifest['key'] == self._cache_key()
+        
+    def build_cache(self,workers=1,use_threads=False):
+        """ reads all the .vtu pieces and writes them to the binary cache in self.cache_dir
+
+        The cache is a directory of .npy files: the global coordinates, the connectivity 
+        of all pieces stacked into one array and one per-element array for each field, 
+        plus a manifest.json with the piece boundaries and the key of the source files. 
+        Fields are gathered and written one at a time. 
+        """
+        key=self._cache_key()
+        # create the cache directory first, so that an unwritable location fails 
+        # before the pieces are read
+        tmp_dir=self.cache_dir+'.tmp'
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        self._load_pieces(workers,use_threads,fields=[],lazy=True)
+        
+        print(f"writing cache to {self.cache_dir}")
+        np.save(os.path.join(tmp_dir,'coordinates.npy'),self.coordinates)
+        np.save(os.path.join(tmp_dir,'connectivity.npy'),self._connectivity_block)
+        field_files={}
+        for fld_name in list(self._point_data.keys()):
+            field_files[fld_name]=_cache_file_name(fld_name)
+            np.save(os.path.join(tmp_dir,field_files[fld_name]),self._point_data[fld_name][self._connectivity_block])
+            del self._point_data[fld_name]
+            
+        manifest={'key':key,'source':os.path.abspath(self.file),
+                  'cell_starts':[int(c) for c in self._cell_starts],
+                  'point_starts':[int(p) for p in self._point_starts],'fields':field_files}
+        with open(os.path.join(tmp_dir,'manifest.json'),'w') as mfi:
+            json.dump(manifest,mfi)
+        
+        if os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir)
+        os.rename(tmp_dir,self.cache_dir)
+        self.release()
+        
+    def load_cache(self,fields=None,piece_ids=None):
+        """ memory-maps a cache written by build_cache
+
+        Parameters
+        ----------
+        fields : list of str
+            fields to include in node_data (.pvtu or component names), default None 
+            includes all cached fields. Arrays are memory-mapped, so fields are only 
+            read from disk as they are used. 
+        piece_ids : list of int
+            if not None, only these pieces are loaded. Their coordinates are copied out 
+            of the cache and their connectivity renumbered to match.
+        """
+        manifest=self._read_manifest()
+        if manifest is None:
+            raise ValueError(f"no cache found in {self.cache_dir}")
+        if piece_ids is not None:
+            self._load_cache_pieces(manifest,fields,piece_ids)
+            return
+            
+        self.coordinates=np.load(os.path.join(self.cache_dir,'coordinates.npy'),mmap_mode='r')
+        self._connectivity_block=np.load(os.path.join(self.cache_dir,'connectivity.npy'),mmap_mode='r')
+        self._cell_starts=np.array(manifest['cell_starts'])
+        field_arrays={fld_name:np.load(os.path.join(self.cache_dir,fi),mmap_mode='r') 
+                      for fld_name,fi in manifest['fields'].items() if _is_selected(fld_name,fields,self.fields)}
+        
+        self.connectivity=[]
+        self.node_data=[]
+        self._point_data={}
+        self._lazy_connectivity=None
+        for mesh_id in range(len(self._cell_starts)-1):
+            c0,c1=self._cell_starts[mesh_id],self._cell_starts[mesh_id+1]
+            mesh_name="connect{meshnum}".format(meshnum=mesh_id+1)
+            self.connectivity.append(self._connectivity_block[c0:c1])
+            self.node_data.append({(mesh_name,fld_name):arr[c0:c1] for fld_name,arr in field_arrays.items()})
+            
+    def _load_cache_pieces(self,manifest,fields,piece_ids):
+        # loads a subset of the pieces from the cache 
+        coords=np.load(os.path.join(self.cache_dir,'coordinates.npy'),mmap_mode='r')
+        con_block=np.load(os.path.join(self.cache_dir,'connectivity.npy'),mmap_mode='r')
+        field_arrays={fld_name:np.load(os.path.join(self.cache_dir,fi),mmap_mode='r') 
+                      for fld_name,fi in manifest['fields'].items() if _is_selected(fld_name,fields,self.fields)}
+        cell_starts=manifest['cell_starts']
+        pt_starts=manifest['point_starts']
+        
+        n_pts=[pt_starts[piece_id+1]-pt_starts[piece_id] for piece_id in piece_ids]
+        n_cells=[cell_starts[piece_id+1]-cell_starts[piece_id] for piece_id in piece_ids]
+        new_pt_starts=np.concatenate([[0],np.cumsum(n_pts)]).astype(int)
+        new_cell_starts=np.concatenate([[0],np.cumsum(n_cells)]).astype(int)
+        self.coordinates=np.empty((new_pt_starts[-1],3),dtype=coords.dtype)
+        self._connectivity_block=np.empty((new_cell_starts[-1],con_block.shape[1]),dtype=con_block.dtype)
+        self.connectivity=[]
+        self.node_data=[]
+        self._point_data={}
+        self._lazy_connectivity=None
+        for mesh_id,piece_id in enumerate(piece_ids):
+            p0,p1=pt_starts[piece_id],pt_starts[piece_id+1]
+            c0,c1=cell_starts[piece_id],cell_starts[piece_id+1]
+            np.copyto(self.coordinates[new_pt_starts[mesh_id]:new_pt_starts[mesh_id+1]],coords[p0:p1])
+            con_view=self._connectivity_block[new_cell_starts[mesh_id]:new_cell_starts[mesh_id+1]]
+            np.add(con_block[c0:c1],new_pt_starts[mesh_id]-p0,out=con_view)
+            
+            mesh_name="connect{meshnum}".format(meshnum=mesh_id+1)
+            self.connectivity.append(con_view)
+            self.node_data.append({(mesh_name,fld_name):arr[c0:c1] for fld_name,arr in field_arrays.items()})
+        self._cell_starts=new_cell_starts
+        self._point_starts=new_pt_starts
+        
+    def piece_index(self,workers=1,use_threads=False):
+        """ returns the bounding box of every piece, building the index if needed 
+
+        Parameters
+        ----------
+        workers : int
+            number of pieces to read concurrently if the index has to be built from the 
+            .vtu files (default 1)
+        use_threads : bool
+            use a thread pool instead of a process pool when workers > 1 (default False)
+
+        Returns
+        -------
+        piece_bounds : ndarray
+            (n_pieces, 2, 3) array with the [left_edge, right_edge] of each piece.
+
+        The index is persisted to self.index_file, keyed on the source files like the 
+        cache, unless that location cannot be written. It is built from a valid cache if there is one, otherwise by reading the 
+        points of every .vtu file once.
+        """
+        if self.piece_bounds is not None:
+            return self.piece_bounds
+            
+        key=self._cache_key()
+        if os.path.isfile(self.index_file):
+            with open(self.index_file) as ifi:
+                index=json.load(ifi)
+            if index['key'] == key:
+                self.piece_bounds=np.array(index['bounds'])
+                return self.piece_bounds
+                
+        manifest=self._read_manifest()
+        if self.cache_is_valid() and 'point_starts' in manifest:
+            coords=np.load(os.path.join(self.cache_dir,'coordinates.npy'),mmap_mode='r')
+            pt_starts=manifest['point_starts']
+            bounds=[[coords[p0:p1].min(axis=0),coords[p0:p1].max(axis=0)] for p0,p1 in zip(pt_starts[:-1],pt_starts[1:])]
+        else:
+            print("building piece index from the .vtu files")
+            srcFiles=self._source_files()
+            if workers > 1:
+                Pool = ThreadPoolExecutor if use_threads else ProcessPoolExecutor
+                with Pool(max_workers=workers) as pool:
+                    bounds=list(pool.map(_read_piece_bounds,srcFiles))
+            else:
+                bounds=[_read_piece_bounds(srcFi) for srcFi in srcFiles]
+        self.piece_bounds=np.array(bounds,dtype='f8')
+        
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.index_file)),exist_ok=True)
+            with open(self.index_file+'.tmp','w') as ifi:
+                json.dump({'key':key,'bounds':self.piece_bounds.tolist()},ifi)
+            os.replace(self.index_file+'.tmp',self.index_file)
+        except OSError as err:
+            print(f"could not write the piece index to {self.index_file} ({err}), keeping it in memory only")
+        return self.piece_bounds
+        
+    def select_pieces(self,box=None,plane=None,boxes=None,workers=1,use_threads=False):
+        """ returns the ids of the pieces intersecting a box, a plane and/or a set of boxes 
+
+        Parameters
+        ----------
+        box : tuple
+            (left_edge, right_edge) of a box, each of length 3 
+        plane : tuple
+            (axis, coordinate) of an axis-aligned plane, axis is 0, 1, 2 or 'x', 'y', 'z'
+        boxes : array-like
+            (n_boxes, 2, 3) array of [left_edge, right_edge], pieces are selected if 
+            they intersect any of these boxes
+        workers, use_threads : 
+            passed to piece_index if the index needs to be built
+
+        Pieces must intersect each of box, plane and boxes that are given.
+        """
+        bounds=self.piece_index(workers=workers,use_threads=use_threads)
+        hit=np.ones((bounds.shape[0],),dtype=bool)
+        if box is not None:
+            hit&=_boxes_intersect(bounds,np.asarray(box,dtype='f8')[None,:,:]).any(axis=1)
+        if boxes is not None:
+            hit&=_boxes_intersect(bounds,np.asarray(boxes,dtype='f8')).any(axis=1)
+        if plane is not None:
+            axis,coord=plane
+            if isinstance(axis,str):
+                axis='xyz'.index(axis)
+            hit&=(bounds[:,0,axis] <= coord) & (bounds[:,1,axis] >= coord)
+        return [int(piece_id) for piece_id in np.nonzero(hit)[0]]
+            
+    def release(self):
+        """ drops the references to all loaded arrays so that they can be freed """
+        self.connectivity = None
+        self.coordinates = None
+        self.node_data = None
+        self._point_data = {}
+        self._lazy_connectivity = None
+        self._connectivity_block = None
+            
+    def loadPiece(self,srcFi,mesh_name,connectivity_offset=0): 
+        [connectivity,coords,node_data,_]=_read_piece(srcFi,mesh_name,self.fields)
 
         # offset the connectivity matrix to global value 
-        connectivity=np.array(connectivity)+connectivity_offset
+        connectivity=connectivity+connectivity_offset
 
         return [connectivity,coords,node_data]
     
-    def parseNodeData(self,point_data,connectivity,mesh_name):
-        
-        # for each field, evaluate field data by index, reshape to match connectivity 
-        con1d=connectivity.ravel() 
-        conn_shp=connectivity.shape 
-        
-        comp_hash={0:'cx',1:'cy',2:'cz'}
-        def rshpData(data1d):
-            return np.reshape(data1d[con1d],conn_shp)
-            
-        node_data={}        
-        for fld in self.fields: 
-            nm=fld['@Name']
-            if nm in point_data.keys():
-                if '@NumberOfComponents' in fld.keys() and int(fld['@NumberOfComponents'])>1:
-                    # we have a vector, deal with components
-                    for component in range(int(fld['@NumberOfComponents'])): 
-                        comp_name=nm+'_'+comp_hash[component] # e.g., velocity_cx 
-                        m_F=(mesh_name,comp_name) # e.g., ('connect1','velocity_cx')
-                        node_data[m_F]=rshpData(point_data[nm][:,component])
+    def parseNodeData(self,point_data,connectivity,mesh_name,fields=None):
+        return _parse_node_data(self.fields,point_data,connectivity,mesh_name,fields)
+
+
+class pvuSeries(object):
+    """ 
+    iterates over a time series of .pvtu files, loading the next timestep in the 
+    background while the current one is being processed. 
+    
+    Parameters
+    ----------
+    files : str or list of str
+        a directory containing the series or an explicit list of .pvtu files
+    pattern : str
+        glob pattern for the .pvtu files when files is a directory 
+        (default 'solution-*.pvtu'). Files are sorted by name.
+    prefetch : bool
+        if True (default), load step N+1 in a background thread while step N is 
+        being processed.
+    cache_root : str
+        if not None, the cache and piece index of each timestep go to 
+        cache_root/<.pvtu name> instead of the default location in the data 
+        directory (e.g., for read-only data). Default None.
+    file_kwargs : dict
+        keyword arguments passed to pvuFile for every timestep (e.g., dataDir). 
+        Use cache_root rather than cache_dir or index_file, which would be shared 
+        by all timesteps.
+    **load_kwargs 
+        passed on to pvuFile.load for every timestep (e.g., fields, workers, use_cache)
+    
+    Iterating yields loaded pvuFile instances. Once the loop moves on, the previous 
+    step is released (see pvuFile.release), so at most two timesteps are held by the 
+    series at any time. Anything built from a step (e.g., a yt dataset) holds its own 
+    references and should be dropped by the caller as well.
+    
+    e.g.,
+    
+    for pvuData in pvuSeries(DataDir, fields=['strain_rate'], use_cache=True):
+        ds = yt.load_unstructured_mesh(pvuData.connectivity, pvuData.coordinates, 
+                                       node_data=pvuData.node_data)
+    """
+    def __init__(self,files,pattern='solution-*.pvtu',prefetch=True,cache_root=None,file_kwargs=None,
+                 **load_kwargs):
+        if isinstance(files,str):
+            files=sorted(glob.glob(os.path.join(files,pattern)))
+        self.files=list(files)
+        self.prefetch=prefetch
+        self.cache_root=cache_root
+        self.file_kwargs=dict(file_kwargs) if file_kwargs is not None else {}
+        shared=[key for key in ('cache_dir','index_file') if key in self.file_kwargs]
+        if len(shared):
+            raise ValueError(f"{shared} would be shared by every timestep, use cache_root instead")
+        self.load_kwargs=load_kwargs
+        
+    def __len__(self):
+        return len(self.files)
+        
+    def __getitem__(self,step):
+        return self._load_step(self.files[step])
+        
+    def _load_step(self,file):
+        file_kwargs=dict(self.file_kwargs)
+        if self.cache_root is not None:
+            pvtu_name=os.path.splitext(os.path.basename(file))[0]
+            file_kwargs['cache_dir']=os.path.join(self.cache_root,pvtu_name)
+        pvuData=pvuFile(file,**file_kwargs)
+        pvuData.load(**self.load_kwargs)
+        return pvuData
+        
+    def __iter__(self):
+        if self.prefetch is False:
+            for file in self.files:
+                pvuData=self._load_step(file)
+                yield pvuData
+                pvuData.release()
+            return
+            
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            next_step=pool.submit(self._load_step,self.files[0]) if len(self.files) else None
+            for step in range(len(self.files)):
+                pvuData=next_step.result()
+                if step+1 < len(self.files):
+                    next_step=pool.submit(self._load_step,self.files[step+1])
                 else:
-                    # just a scalar! 
-                    m_F=(mesh_name,nm) # e.g., ('connect1','T')
-                    node_data[m_F]=rshpData(point_data[nm])
+                    next_step=None
+                yield pvuData
+                pvuData.release()
+                del pvuData
+
+
+class lazyNodeData(Mapping):
+    """ 
+    node_data dict for a single mesh piece that gathers some of its fields the first 
+    time they are accessed. 
     
-        return node_data
+    Parameters
+    ----------
+    node_data : dict
+        already gathered fields, keyed by (mesh_name, field_name)
+    gatherers : dict
+        callables returning the per-element array of each lazy field, same keys
+
+    Iterating (keys, items, values, len) only covers the fields gathered so far, so 
+    consumers that copy every entry, like yt.load_unstructured_mesh, do not gather 
+    the lazy fields. Lazy fields are gathered by explicit indexing, e.g., 
+    node_d[('connect1','T')], and listed by available_keys.
+    """
+    def __init__(self,node_data,gatherers):
+        self._data=dict(node_data)
+        self._gatherers=gatherers
+        
+    def __getitem__(self,key):
+        if key not in self._data:
+            self._data[key]=self._gatherers[key]()
+        return self._data[key]
+        
+    def __contains__(self,key):
+        return key in self._data or key in self._gatherers
+        
+    def __iter__(self):
+        return iter(list(self._data.keys()))
+        
+    def __len__(self):
+        return len(self._data)
+        
+    def available_keys(self):
+        """ the keys of the gathered and the lazy fields """
+        return list(self._data.keys())+[key for key in self._gatherers.keys() if key not in self._data]
+        
+    def is_loaded(self,key):
+        return key in self._data
+
+
+def _cache_file_name(fld_name):
+    # .npy file name for a cached field, with anything unusual in the name replaced 
+    return 'node_'+re.sub(r'[^\w.-]','_',fld_name)+'.npy'
+
+
+def _read_piece_header(srcFi,nbytes=4096): 
+    # returns (NumberOfPoints, NumberOfCells) from the <Piece> tag of a .vtu file without 
+    # parsing the data arrays, (None, None) if the tag is not found in the first nbytes.
+    with open(srcFi,'rb') as vtu:
+        head=vtu.read(nbytes)
+    n_pts=re.search(rb'NumberOfPoints="(\d+)"',head)
+    n_cells=re.search(rb'NumberOfCells="(\d+)"',head)
+    if n_pts is None or n_cells is None:
+        return (None,None)
+    return (int(n_pts.group(1)),int(n_cells.group(1)))
+
+
+def _boxes_intersect(bounds,boxes):
+    # (n_bounds, n_boxes) boolean array, True where bounds[i] and boxes[j] overlap
+    overlap=(bounds[:,None,0,:] <= boxes[None,:,1,:]) & (bounds[:,None,1,:] >= boxes[None,:,0,:])
+    return overlap.all(axis=2)
+
+
+def _read_piece_bounds(srcFi):
+    # [left_edge, right_edge] of the points in a .vtu file
+    coords=meshio.read(srcFi).points
+    return [coords.min(axis=0),coords.max(axis=0)]
+
+
+def _read_piece(srcFi,mesh_name,fields,selected=None,lazy=False): 
+    # reads a single .vtu file, module-level so that it can be sent to a process pool. 
+    # connectivity is returned without any global offset. If lazy, the per-node arrays 
+    # of fields not in selected are also returned.
+    meshPiece=meshio.read(srcFi) # read it in with meshio     
+    coords=meshPiece.points # coords and node_data are already global
+    cell_type = list(meshPiece.cells_dict.keys())[0]
+    
+    connectivity=np.array(meshPiece.cells_dict[cell_type]) # 2D connectivity array 
+
+    # parse node data 
+    node_data=_parse_node_data(fields,meshPiece.point_data,connectivity,mesh_name,selected)
+    
+    raw_data={}
+    if lazy and selected is not None:
+        for nm,component,fld_name in _field_components(fields):
+            if nm in meshPiece.point_data.keys() and not _is_selected(fld_name,selected,fields):
+                data1d=meshPiece.point_data[nm]
+                raw_data[fld_name]=data1d if component is None else data1d[:,component]
+
+    return [connectivity,coords,node_data,raw_data]
+
+
+def _field_components(fields):
+    # (.pvtu name, component index or None, node_data field name) for each PPointData 
+    # field, vectors are split into components, e.g., ('velocity', 0, 'velocity_cx')
+    comp_hash={0:'cx',1:'cy',2:'cz'}
+    components=[]
+    for fld in fields: 
+        nm=fld['@Name']
+        if '@NumberOfComponents' in fld.keys() and int(fld['@NumberOfComponents'])>1:
+            for component in range(int(fld['@NumberOfComponents'])): 
+                components.append((nm,component,nm+'_'+comp_hash[component]))
+        else:
+            components.append((nm,None,nm))
+    return components
+
+
+def _is_selected(fld_name,selected,fields):
+    # True if a node_data field name is requested in selected, either directly or 
+    # through the name of the vector it is a component of 
+    if selected is None or fld_name in selected:
+        return True
+    for nm,component,comp_name in _field_components(fields):
+        if comp_name == fld_name:
+            return nm in selected
+    return False
+
+
+def _parse_node_data(fields,point_data,connectivity,mesh_name,selected=None):
+    
+    # for each field, evaluate field data by index, reshape to match connectivity 
+    con1d=connectivity.ravel() 
+    conn_shp=connectivity.shape 
+    
+    def rshpData(data1d):
+        return np.reshape(data1d[con1d],conn_shp)
+        
+    node_data={}        
+    for nm,component,fld_name in _field_components(fields): 
+        if nm in point_data.keys() and _is_selected(fld_name,selected,fields):
+            m_F=(mesh_name,fld_name) # e.g., ('connect1','velocity_cx') or ('connect1','T')
+            if component is None:
+                node_data[m_F]=rshpData(point_data[nm])
+            else:
+                node_data[m_F]=rshpData(point_data[nm][:,component])
+
+    return node_data
@@ -1,13 +1,18 @@
 # imports and initialization
 import os
 import sys
+from functools import partial
+import numpy as np
 import yt
 import matplotlib.pyplot as plt
+from yt.visualization.volume_rendering.api import create_volume_source
 from yt_velmodel_vis import seis_model as SM, transferfunctions as TFs
 
 
 sys.path.append(os.path.abspath("../notebooks/resources"))
 import seismic_helper as SH
+from mesh_animator.tiled_render import render_tiled
+import cm1_helper as CH
 
 ###################
 # volume rendering
@@ -23,38 +28,101 @@ datafld='dvs' # the field to visualize, must be a variable in the netCDF file
 interp_dict={'field':datafld,'max_dist':50000,'res':[10000,10000,10000],
               'input_units':'m','interpChunk':int(1e7)}
 
-# load the model
-model=SM.netcdf(modelfile,interp_dict)
+# the interpolated grid is written here once for the tile processes to memory-map
+grid_dir='./.render_cache'
 
-# set some objects required for loading in yt
-bbox = model.cart['bbox'] # the bounding box of interpolated cartesian grid
-data={datafld:model.interp['data'][datafld]} # data container for yt scene
+def build_scene(res_factor=1):
+    # load the model
+    model=SM.netcdf(modelfile,interp_dict)
 
-# load the data as a uniform grid, create the 3d scene
-ds = yt.load_uniform_grid(data,data[datafld].shape,1.0,bbox=bbox,nprocs=1,
-                        periodicity=(True,True,True),unit_system="mks")
+    # set some objects required for loading in yt
+    bbox = model.cart['bbox'] # the bounding box of interpolated cartesian grid
+    data={datafld:model.interp['data'][datafld]} # data container for yt scene
 
-# setting up transfer functions
-tfOb = TFs.dv(data[datafld].ravel(), bounds=[-4, 4])
+    # load the data as a uniform grid, create the 3d scene
+    ds = yt.load_uniform_grid(data,data[datafld].shape,1.0,bbox=bbox,nprocs=1,
+                            periodicity=(True,True,True),unit_system="mks")
 
-# segment 1, slow anomalies
-bnds = [-1.3, -.3]
-TFseg = TFs.TFsegment(tfOb, bounds=bnds, cmap='OrRd_r')
-alpha_o = 0.95
-Dalpha = -0.85
-alpha = alpha_o + Dalpha / (bnds[1] - bnds[0]) * (TFseg.dvbins_c - bnds[0])
-tfOb.addTFsegment(alpha, TFseg)
+    # build the scene
+    tfOb = build_transfer_function(data[datafld])
+    sc = SH.configure_scene(ds, datafld, model, bbox, tfOb.tf,res_factor=res_factor)
+    return sc
 
-# segment 2, fast anomalies
-bnds = [.1, .35]
-TFseg = TFs.TFsegment(tfOb, bounds=bnds, cmap='winter_r')
-alpha_o = .6
-Dalpha = .4
-alpha = alpha_o + Dalpha / (bnds[1] - bnds[0]) * (TFseg.dvbins_c - bnds[0])
-tfOb.addTFsegment(alpha, TFseg)
+def build_transfer_function(values):
+    # setting up transfer functions
+    tfOb = TFs.dv(values.ravel(), bounds=[-4, 4])
 
-# build the scene
-sc = SH.configure_scene(ds, datafld, model, bbox, tfOb.tf,res_factor=5)
+    # segment 1, slow anomalies
+    bnds = [-1.3, -.3]
+    TFseg = TFs.TFsegment(tfOb, bounds=bnds, cmap='OrRd_r')
+    alpha_o = 0.95
+    Dalpha = -0.85
+    alpha = alpha_o + Dalpha / (bnds[1] - bnds[0]) * (TFseg.dvbins_c - bnds[0])
+    tfOb.addTFsegment(alpha, TFseg)
 
-sc.save('../figures/seismic_vol_render_highres.png',sigma_clip=1.5)
+    # segment 2, fast anomalies
+    bnds = [.1, .35]
+    TFseg = TFs.TFsegment(tfOb, bounds=bnds, cmap='winter_r')
+    alpha_o = .6
+    Dalpha = .4
+    alpha = alpha_o + Dalpha / (bnds[1] - bnds[0]) * (TFseg.dvbins_c - bnds[0])
+    tfOb.addTFsegment(alpha, TFseg)
+    return tfOb
+
+def save_grid(model):
+    # writes the interpolated field to a .npy file, returns the file name
+    os.makedirs(grid_dir, exist_ok=True)
+    grid_file = os.path.join(grid_dir, os.path.splitext(os.path.basename(modelfile))[0] + '_' + datafld + '.npy')
+    np.save(grid_file, model.interp['data'][datafld])
+    return grid_file
+
+def build_tile_scene(grid_file, bbox, tf, res_factor=1, stride=8):
+    # builds the scene on a coarse copy of the interpolated grid: the camera and the
+    # annotations only depend on the domain, the data in view of each tile is
+    # swapped in by load_region
+    values = np.load(grid_file, mmap_mode='r')
+    data = {datafld: np.array(values[::stride, ::stride, ::stride])}
+    ds = yt.load_uniform_grid(data,data[datafld].shape,1.0,bbox=bbox,nprocs=1,
+                            periodicity=(True,True,True),unit_system="mks")
+    model = SM.netcdf(modelfile) # the model without its interpolation, for the annotations
+    return SH.configure_scene(ds, datafld, model, bbox, tf, res_factor=res_factor)
+
+def load_region(grid_file, bbox, tf, sc, pad=2):
+    # replaces the volume source of the scene by one holding only the cells of the
+    # memory-mapped grid in view of the camera, padded by pad cells
+    values = np.load(grid_file, mmap_mode='r')
+    bbox = np.asarray(bbox, dtype='float64')
+    shape = np.array(values.shape)
+    dx = (bbox[:, 1] - bbox[:, 0]) / shape
+    view_left, view_right = CH.view_box(sc.camera)
+    i0 = np.clip(np.floor((view_left - bbox[:, 0]) / dx).astype(int) - pad, 0, shape - 1)
+    i1 = np.clip(np.ceil((view_right - bbox[:, 0]) / dx).astype(int) + pad, i0 + 1, shape)
+    sub = np.array(values[i0[0]:i1[0], i0[1]:i1[1], i0[2]:i1[2]])
+    sub_bbox = np.column_stack([bbox[:, 0] + i0 * dx, bbox[:, 0] + i1 * dx])
+    # only wrap around the axes that the region covers entirely, as the full grid does
+    periodicity = tuple(bool(i0[dim] == 0 and i1[dim] == shape[dim]) for dim in range(3))
+    ds = yt.load_uniform_grid({datafld: sub},sub.shape,1.0,bbox=sub_bbox,nprocs=1,
+                            periodicity=periodicity,unit_system="mks")
+    source = create_volume_source(ds, datafld)
+    source.set_transfer_function(tf)
+    sc.add_source(source, keyname='source_00')
+
+if __name__ == '__main__':
+    # build the interpolation (if needed) and the transfer function once, and write
+    # the interpolated grid for the render processes to memory-map
+    model = SM.netcdf(modelfile,interp_dict)
+    bbox = model.cart['bbox']
+    tfOb = build_transfer_function(model.interp['data'][datafld])
+    grid_file = save_grid(model)
+    del model
+
+    # render the 5x resolution image in 5 x 5 tiles across the processes. Each
+    # process builds its scene on a coarse copy of the grid and then only reads the
+    # cells in view of the tile it renders from the memory-mapped grid, so its
+    # memory is set by the tile rather than the model.
+    res_factor = 5
+    render_tiled(partial(build_tile_scene, grid_file, bbox, tfOb.tf, res_factor=res_factor),
+                 '../figures/seismic_vol_render_highres.png', tiles=res_factor,
+                 workers=min(os.cpu_count(), res_factor**2), sigma_clip=1.5,
+                 tile_setup=partial(load_region, grid_file, bbox, tfOb.tf))
 
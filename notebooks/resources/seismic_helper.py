@@ -1,27 +1,59 @@
 import os,yt, numpy as np
-from yt_velmodel_vis import seis_model as SM, shapeplotter as SP, transferfunctions as TFs
+import hashlib
+import json
+import weakref
+import zipfile
+from yt.visualization.volume_rendering.api import LineSource, PointSource
 import matplotlib.pyplot as plt
 
-def build_yt_scene(ds, datafld, model, bbox):
+# annotation settings of build_yt_scene
+Depth_Range = [0, 1200]
+R = 6371.
+tect_clrs = {
+    'transform': [0.8, 0., 0.8, 0.05],
+    'ridge': [0., 0., 0.8, 0.05],
+    'trench': [0.8, 0., 0., 0.05],
+    'global_volcanos': [0., 0.8, 0., 0.05]
+}
+
+def build_yt_scene(ds, datafld, model, bbox, cache_dir='./.annotation_cache'):
     """ builds the yt scene:
 
     - Draws the spherical chunk bounding the dataset
     - Draws a latitude/longitude grid at surface
     - Draws shapefile data: US political boundaries, tectonic boundaries, volcanos
 
+    The vertices and colors of the annotations are cached in cache_dir (set to
+    False to disable), keyed by the bounding box, radii and RGBa values, so that
+    repeat builds skip the geometry and shapefile work.
     """
 
     # create the scene (loads full dataset into the scene for rendering)
     sc = yt.create_scene(ds, datafld)
 
     # add useful annotations to the scene in two parts: 1. Domain Annotations and 2. Shapefile Data
+    lat_rnge = [float(np.min(model.data.variables['latitude'])), float(np.max(model.data.variables['latitude']))]
+    lon_rnge = [float(np.min(model.data.variables['longitude'])), float(np.max(model.data.variables['longitude']))]
+
+    key = _annotation_key(ds, bbox, lat_rnge, lon_rnge)
+    if cache_dir is not False:
+        cache_file = os.path.join(cache_dir, 'annotations_' + hashlib.sha1(key.encode()).hexdigest()[:16] + '.npz')
+        if _load_annotations(sc, cache_file, key):
+            return sc
+
+    n_sources = len(sc.sources)
+    sc = _draw_annotations(sc, lat_rnge, lon_rnge)
+    if cache_dir is not False:
+        _save_annotations(list(sc.sources.values())[n_sources:], cache_file, key)
+    return sc
+
+
+def _draw_annotations(sc, lat_rnge, lon_rnge):
+    # only needed when the annotations are not cached
+    from yt_velmodel_vis import shapeplotter as SP
 
     # 1. Domain Annotations :
     # define the extent of the spherical chunk
-    lat_rnge = [np.min(model.data.variables['latitude']), np.max(model.data.variables['latitude'])]
-    lon_rnge = [np.min(model.data.variables['longitude']), np.max(model.data.variables['longitude'])]
-    Depth_Range = [0, 1200]
-    R = 6371.
     r_rnge = [(R - Depth_Range[1]) * 1000., (R - Depth_Range[0]) * 1000.]
 
     # create a spherical chunk object
@@ -43,20 +75,69 @@ def build_yt_scene(ds, datafld, model, bbox):
     thisshp = SP.shapedata('us_states', bbox=shp_bbox, radius=R * 1000.)
     sc = thisshp.addToScene(sc)
 
-    # tectonic boundaries: buid a dictionary with unique RGBa values for each
-    clrs = {
-        'transform': [0.8, 0., 0.8, 0.05],
-        'ridge': [0., 0., 0.8, 0.05],
-        'trench': [0.8, 0., 0., 0.05],
-        'global_volcanos': [0., 0.8, 0., 0.05]
-    }
+    # tectonic boundaries: uses a dictionary with unique RGBa values for each
     for bound in ['transform', 'ridge', 'trench', 'global_volcanos']:
         tect = SP.shapedata(bound, radius=R * 1000., buildTraces=False)
-        sc = tect.buildTraces(RGBa=clrs[bound], sc=sc, bbox=shp_bbox)
+        sc = tect.buildTraces(RGBa=tect_clrs[bound], sc=sc, bbox=shp_bbox)
 
     return sc
 
 
+def _annotation_key(ds, bbox, lat_rnge, lon_rnge):
+    # everything the annotation geometry depends on. _draw_annotations hard-codes
+    # the remaining RGBa values and grid sizes, bump the version when changing them.
+    return json.dumps({'version': 1, 'bbox': np.asarray(bbox, dtype='f8').tolist(),
+                       'lat': lat_rnge, 'lon': lon_rnge, 'R': R, 'depth': Depth_Range,
+                       'tect_clrs': tect_clrs, 'length_unit': str(ds.length_unit)}, sort_keys=True)
+
+
+def _save_annotations(sources, cache_file, key):
+    # the positions of sources added to a scene are already in code_length
+    arrays = {}
+    for i, src in enumerate(sources):
+        arrays['colors_' + str(i)] = np.asarray(src.colors)
+        arrays['stride_' + str(i)] = src.color_stride
+        if isinstance(src, LineSource):
+            arrays['positions_' + str(i)] = np.asarray(src.positions).reshape(-1, 2, 3)
+        else:
+            arrays['positions_' + str(i)] = np.asarray(src.positions)
+            arrays['radii_' + str(i)] = np.asarray(src.radii)
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    # concurrent renders may build the same cache, each writes its own temporary
+    # file and the last complete one replaces the cache file
+    tmp_file = cache_file + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_file, 'wb') as cfi:
+        np.savez(cfi, key=key, n_sources=len(sources), **arrays)
+    os.replace(tmp_file, cache_file)
+
+
+def _load_annotations(sc, cache_file, key):
+    # adds the cached line and point sources to the scene, returns False if there
+    # is no valid cache. An unreadable cache file counts as missing.
+    if os.path.isfile(cache_file) is False:
+        return False
+    sources = []
+    try:
+        with np.load(cache_file) as cached:
+            if str(cached['key']) != key:
+                return False
+            for i in range(int(cached['n_sources'])):
+                positions = cached['positions_' + str(i)]
+                colors = cached['colors_' + str(i)]
+                stride = int(cached['stride_' + str(i)])
+                if 'radii_' + str(i) in cached:
+                    src = PointSource(positions, colors, color_stride=stride, radii=cached['radii_' + str(i)])
+                else:
+                    src = LineSource(positions, colors, color_stride=stride)
+                sources.append(src)
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as err:
+        print(f"ignoring unreadable annotation cache {cache_file}: {err}")
+        return False
+    for src in sources:
+        sc.add_source(src)
+    return True
+
+
 def getCenterVec(bbox):
     # center vector
     x_c = np.mean(bbox[0])
@@ -78,6 +159,86 @@ def setCamera(sc, bbox):
     init_width = sc.camera.width
     sc.camera.width = (init_width * zoom_factor)
 
+class histCache(object):
+    """
+    fine-binned histogram of a data array, computed in a single pass over chunks of
+    the flattened array, that can be cheaply re-binned for plotting.
+
+    Parameters
+    ----------
+    values : ndarray
+        the data to histogram, NaNs are skipped
+    bounds : list
+        [min, max] range of the fine bins. Default None uses the nan-min and nan-max
+        of the data (one extra reduction over the array, without copies). Values
+        outside of bounds are counted in self.n_below and self.n_above.
+    n_bins : int
+        number of fine bins (default 10000)
+    chunk_size : int
+        number of values histogrammed at a time (default 1e7)
+    """
+    def __init__(self, values, bounds=None, n_bins=10000, chunk_size=int(1e7)):
+        flat = np.asarray(values).reshape(-1)
+        if bounds is None:
+            bounds = [np.nanmin(flat), np.nanmax(flat)]
+        self.bounds = [float(bounds[0]), float(bounds[1])]
+        self.edges = np.linspace(self.bounds[0], self.bounds[1], n_bins + 1)
+        self.counts = np.zeros(n_bins, dtype='int64')
+        self.n_below = 0
+        self.n_above = 0
+        for i0 in range(0, flat.size, chunk_size):
+            chunk = flat[i0:i0 + chunk_size]
+            chunk = chunk[~np.isnan(chunk)]
+            self.counts += np.histogram(chunk, bins=self.edges)[0]
+            self.n_below += int(np.count_nonzero(chunk < self.bounds[0]))
+            self.n_above += int(np.count_nonzero(chunk > self.bounds[1]))
+        self._cumulative = np.concatenate([[0], np.cumsum(self.counts)])
+
+    def rebin(self, bins=100, bounds=None, density=False):
+        """ returns (counts, edges) for bins equal-width bins over bounds (default
+        self.bounds), or for an array of bin edges. Bin edges that fall within a
+        fine bin split its count linearly. """
+        if np.isscalar(bins):
+            if bounds is None:
+                bounds = self.bounds
+            edges = np.linspace(bounds[0], bounds[1], bins + 1)
+        else:
+            edges = np.asarray(bins, dtype='f8')
+        counts = np.diff(np.interp(edges, self.edges, self._cumulative))
+        if density:
+            total = counts.sum()
+            if total > 0:
+                counts = counts / (total * np.diff(edges))
+        return counts, edges
+
+
+# (weak reference to the array, histCache) for each field and histogram settings. The
+# cache does not keep the array alive, the histogram is recomputed once it is freed.
+_hist_caches = {}
+
+def field_histogram(data, datafld, bounds=None, n_bins=10000):
+    """ returns the histCache of data[datafld], computing it on the first call for
+    that array and settings """
+    values = data[datafld]
+    key = (datafld, None if bounds is None else tuple(bounds), n_bins)
+    cached = _hist_caches.get(key)
+    if cached is None or cached[0]() is not values:
+        try:
+            values_ref = weakref.ref(values)
+        except TypeError:
+            # not an array that can be referenced weakly, do not cache
+            return histCache(values, bounds=bounds, n_bins=n_bins)
+        cached = (values_ref, histCache(values, bounds=bounds, n_bins=n_bins))
+        _hist_caches[key] = cached
+    return cached[1]
+
+
+def _plot_hist(ax, hist, bins=100, color='k'):
+    counts, edges = hist.rebin(bins, density=True)
+    ax.bar(edges[:-1], counts, np.diff(edges), align='edge', color=color, linewidth=0)
+    return ax
+
+
 def plotTf_yt(data,tf,dvs_min,dvs_max):
     x = np.linspace(dvs_min,dvs_max,tf.nbins) # RGBa value defined for each dvs bin in range
     y = tf.funcs[3].y # the alpha value of transfer function at each x
@@ -86,35 +247,105 @@ def plotTf_yt(data,tf,dvs_min,dvs_max):
                        tf.funcs[3].y]).T
     fig = plt.figure()
     ax = fig.add_axes([0.2, 0.2, 0.75, 0.75])
-    d_hist=ax.hist(data['dvs'][~np.isnan(data['dvs'])].ravel(),bins=100,density=True,log=False,color='k')
+    _plot_hist(ax, field_histogram(data, 'dvs'), bins=100, color='k')
     ax.bar(x, tf.funcs[3].y, w, edgecolor=[0.0, 0.0, 0.0, 0.0],
            log=False, color=colors, bottom=[0])
     plt.xlabel('$\mathregular{dV_s}$')
     plt.show()
 
 
-def plotTf(tfOb):
-    """ create a histogram-transfer function plot and display it"""
+def plotTf(tfOb, data=None, datafld='dvs', bins=100):
+    """ create a histogram-transfer function plot and display it. If data is not None,
+    the histogram of data[datafld] is drawn from the histogram cache, otherwise from
+    tfOb.addHist"""
     f=plt.figure()
     ax=plt.axes()
-    ax=tfOb.addHist(ax=ax,density=True,color=(0.,0.,0.,1.))
+    if data is None:
+        ax=tfOb.addHist(ax=ax,density=True,color=(0.,0.,0.,1.))
+    else:
+        ax=_plot_hist(ax, field_histogram(data, datafld), bins=bins, color=(0.,0.,0.,1.))
     ax=tfOb.addTFtoPlot(ax=ax)
     ax.set_xlabel('$\mathregular{dV_s}$')
     plt.show()
 
 
-def configure_scene(ds, datafld, model, bbox, the_transfer_function, res_factor=1.):
-    # build scene, apply camera settings, set the transfer function
-    sc = build_yt_scene(ds, datafld, model, bbox)
-    setCamera(sc, bbox)
-    source = sc.sources['source_00']
-    source.set_transfer_function(the_transfer_function)
+class sceneTemplate(object):
+    """
+    builds the volume source, annotations and camera of a seismic scene once so that
+    many transfer functions and resolutions can be rendered against the same scene.
+
+    Parameters
+    ----------
+    ds, datafld, model, bbox :
+        as for build_yt_scene
+    cache_dir : str
+        annotation cache directory, passed to build_yt_scene
+
+    e.g.,
+
+    template = sceneTemplate(ds, datafld, model, bbox)
+    template.render(tfOb.tf, fname='dvs.png', sigma_clip=1.5)
+    template.render_batch({'slow': tf_slow, 'fast': tf_fast}, res_factors=[1, 2],
+                          fname='dvs_{name}_{res_factor}.png')
+    """
+    def __init__(self, ds, datafld, model, bbox, cache_dir='./.annotation_cache'):
+        self.sc = build_yt_scene(ds, datafld, model, bbox, cache_dir=cache_dir)
+        setCamera(self.sc, bbox)
+        self.source = self.sc.sources['source_00']
+        self.base_resolution = self.sc.camera.get_resolution()
+
+    def configure(self, the_transfer_function, res_factor=1.):
+        """ sets the transfer function and the resolution relative to the initial
+        camera resolution, returns the scene """
+        self.source.set_transfer_function(the_transfer_function)
+        res = self.base_resolution
+        new_res = (int(res[0] * res_factor), int(res[1] * res_factor))
+        self.sc.camera.set_resolution(new_res)
+        return self.sc
+
+    def render(self, the_transfer_function, res_factor=1., fname=None, sigma_clip=None):
+        """ renders the scene with a transfer function at a resolution factor, saving
+        to fname if it is not None. Returns the rendered image. """
+        self.configure(the_transfer_function, res_factor)
+        if fname is None:
+            return self.sc.render()
+        self.sc.save(fname, sigma_clip=sigma_clip, render=True)
+        return self.sc._last_render
+
+    def render_batch(self, transfer_functions, res_factors=(1.,), fname=None, sigma_clip=None):
+        """ renders every transfer function at every resolution factor
+
+        Parameters
+        ----------
+        transfer_functions : dict or list
+            the transfer functions to render, a list is named by index
+        res_factors : list
+            resolution factors to render each transfer function at (default (1.,))
+        fname : str
+            if not None, a format string for the file of each image with the fields
+            name and res_factor, e.g., 'dvs_{name}_{res_factor}.png'
+        sigma_clip : None or float
+            passed to sc.save
 
-    # adjust resolution of rendering
-    res = sc.camera.get_resolution()
-    new_res = (int(res[0] * res_factor), int(res[1] * res_factor))
-    sc.camera.set_resolution(new_res)
+        Returns
+        -------
+        dict of the rendered images, keyed by (name, res_factor)
+        """
+        if isinstance(transfer_functions, dict) is False:
+            transfer_functions = dict(enumerate(transfer_functions))
+        images = {}
+        for name, tf in transfer_functions.items():
+            for res_factor in res_factors:
+                fi = None if fname is None else fname.format(name=name, res_factor=res_factor)
+                images[(name, res_factor)] = self.render(tf, res_factor, fname=fi, sigma_clip=sigma_clip)
+        return images
+
+
+def configure_scene(ds, datafld, model, bbox, the_transfer_function, res_factor=1.):
+    # build scene, apply camera settings, set the transfer function and adjust the
+    # resolution of rendering. Use a sceneTemplate to re-use the scene for more
+    # transfer functions or resolutions.
+    sc = sceneTemplate(ds, datafld, model, bbox).configure(the_transfer_function, res_factor)
 
     print("Scene ready to render")
     return sc
-